@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Category, Product, ProductInfo, Order, OrderItem, Contact, Shop, User
+from .models import Category, Product, ProductInfo, Order, OrderItem, Contact, Shop, User, ImportJob, CatalogEntry, \
+    BasketSummary
 
 
 # Register your models here.
@@ -47,6 +48,16 @@ class UserAdmin(admin.ModelAdmin):
     pass
 
 
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'shop', 'state', 'rows_parsed', 'rows_written', 'created_at', 'finished_at']
 
 
+@admin.register(CatalogEntry)
+class CatalogEntryAdmin(admin.ModelAdmin):
+    list_display = ['product_info', 'shop_name', 'category_name', 'product_name', 'price', 'quantity']
 
+
+@admin.register(BasketSummary)
+class BasketSummaryAdmin(admin.ModelAdmin):
+    list_display = ['order', 'lines', 'quantity', 'total_sum', 'is_stale', 'updated_at']
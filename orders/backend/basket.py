@@ -0,0 +1,345 @@
+"""
+Пакетные операции с корзиной покупателя.
+
+У пользователя одна корзина (частичный уникальный индекс unique_user_basket). На PostgreSQL
+она создается запросом INSERT ... ON CONFLICT DO NOTHING без гонки одновременных запросов,
+ИД корзины кэшируется по пользователю до размещения заказа, если кэш общий для процессов.
+
+Строки корзины проверяются все сразу (один запрос к позициям активных магазинов) и пишутся
+пакетно в одной транзакции. Ошибки возвращаются по номерам строк, правильные строки
+записываются.
+
+Размещение заказа из корзины резервирует остатки: позиции блокируются в порядке ИД
+и их количество уменьшается в той же транзакции. Цены позиций и сумма заказа сохраняются
+в заказе.
+
+Итоги корзины (BasketSummary) меняются на разницу, внесенную каждой операцией, и кэшируются
+по пользователю, если кэш общий для процессов. Импорт, изменивший позиции из корзины, помечает
+итоги устаревшими, и они пересчитываются при следующем чтении или изменении корзины.
+"""
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+
+from backend.cache import get_catalog_version, get_shared_cache
+from backend.models import BasketSummary, CatalogEntry, Contact, Order, OrderItem, ProductInfo
+
+
+class OrderPlacementError(ValueError):
+    """
+    Заказ не может быть размещен
+    """
+    def __init__(self, message, shortages=None):
+        super().__init__(message)
+        self.shortages = shortages or []
+
+
+# корзина создается только при отсутствии: конфликт по частичному уникальному индексу unique_user_basket
+BASKET_SQL = """
+    WITH created AS (
+        INSERT INTO backend_order (user_id, dt, status, total_sum) VALUES (%(user)s, now(), 'basket', 0)
+        ON CONFLICT (user_id) WHERE status = 'basket' DO NOTHING
+        RETURNING id
+    )
+    SELECT id FROM created
+    UNION ALL
+    SELECT id FROM backend_order WHERE user_id = %(user)s AND status = 'basket'
+    LIMIT 1
+"""
+
+
+def basket_key(user_id):
+    return f'basket_id:{user_id}'
+
+
+def create_basket(user_id):
+    """
+    ИД корзины пользователя, при отсутствии корзина создается
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(BASKET_SQL, {'user': user_id})
+            row = cursor.fetchone()
+        if row:
+            return row[0]
+        # корзину создал одновременный запрос, зафиксированный после начала INSERT
+        return Order.objects.filter(user_id=user_id, status='basket').values_list('id', flat=True).get()
+    return Order.objects.get_or_create(user_id=user_id, status='basket')[0].id
+
+
+def get_basket_id(user_id):
+    """
+    ИД корзины пользователя из кэша
+    """
+    key = basket_key(user_id)
+    basket_id = get_shared_cache().get(key)
+    if basket_id is None:
+        basket_id = create_basket(user_id)
+        # созданная в откатившейся транзакции корзина не попадает в кэш
+        transaction.on_commit(lambda: get_shared_cache().set(key, basket_id))
+    return basket_id
+
+
+def lock_basket(user_id):
+    """
+    Блокирует корзину пользователя до конца транзакции и возвращает ее ИД.
+    Блокировка упорядочивает одновременные изменения одной корзины
+    """
+    basket_id = get_basket_id(user_id)
+    locked = Order.objects.select_for_update().filter(id=basket_id, user_id=user_id, status='basket')
+    if locked.values_list('id', flat=True).first() is None:
+        # корзина из кэша уже стала заказом или удалена
+        get_shared_cache().delete(basket_key(user_id))
+        basket_id = get_basket_id(user_id)
+        Order.objects.select_for_update().filter(id=basket_id).values_list('id', flat=True).first()
+    return basket_id
+
+
+def summary_key(user_id):
+    # версия каталога меняется после импорта, поэтому итоги с прежними ценами из кэша не читаются
+    return f'basket:{get_catalog_version()}:{user_id}'
+
+
+def rebuild_summary(basket_id):
+    """
+    Полный пересчет итогов корзины одним запросом
+    """
+    summary = BasketSummary(order_id=basket_id)
+    summary.apply({shop_id: (shop_name, lines, quantity, total_sum)
+                   for shop_id, shop_name, lines, quantity, total_sum in OrderItem.objects.filter(
+                       order_id=basket_id).values('product_info__shop_id', 'product_info__shop__name').annotate(
+                       lines=Count('id'), total_quantity=Sum('quantity'),
+                       total_sum=Sum(F('quantity') * F('product_info__price'))).order_by().values_list(
+                       'product_info__shop_id', 'product_info__shop__name', 'lines', 'total_quantity', 'total_sum')})
+    summary.save()
+    return summary
+
+
+def update_summary(user_id, basket_id, changes):
+    """
+    Применяет изменения к итогам корзины, отсутствующие или устаревшие итоги пересчитываются
+    """
+    summary = BasketSummary.objects.filter(order_id=basket_id).first()
+    if summary is None or summary.is_stale:
+        summary = rebuild_summary(basket_id)
+    elif changes:
+        summary.apply(changes)
+        summary.save()
+    key, data = summary_key(user_id), summary.as_dict()
+    transaction.on_commit(lambda: get_shared_cache().set(key, data))
+
+
+def get_summary(user_id):
+    """
+    Итоги корзины пользователя из кэша
+    """
+    cache = get_shared_cache()
+    key = summary_key(user_id)
+    data = cache.get(key)
+    if data is None:
+        if Order.objects.filter(user_id=user_id, status='basket').exists():
+            # пересчет под блокировкой корзины, иначе он затер бы итоги одновременного изменения
+            with transaction.atomic():
+                basket_id = lock_basket(user_id)
+                summary = BasketSummary.objects.filter(order_id=basket_id).first()
+                if summary is None or summary.is_stale:
+                    summary = rebuild_summary(basket_id)
+            data = summary.as_dict()
+        else:
+            data = BasketSummary().as_dict()
+        # итоги, записанные в кэш изменением корзины после чтения, не перезаписываются
+        cache.add(key, data)
+    return data
+
+
+def forget_basket(user_id, basket_id):
+    """
+    Корзина стала заказом: итоги больше не нужны
+    """
+    BasketSummary.objects.filter(order_id=basket_id).delete()
+    get_shared_cache().delete_many([summary_key(user_id), basket_key(user_id)])
+
+
+def mark_summaries_stale(info_ids):
+    """
+    Помечает устаревшими итоги корзин с переданными позициями
+    """
+    BasketSummary.objects.filter(is_stale=False, order__ordered_items__product_info_id__in=list(info_ids)).update(
+        is_stale=True)
+
+
+def add_change(changes, info, lines, quantity):
+    price, shop_id, shop_name = info
+    change = changes[shop_id]
+    changes[shop_id] = (shop_name, change[1] + lines, change[2] + quantity, change[3] + quantity * price)
+
+
+def parse_lines(items, id_field):
+    """
+    Разбирает строки [{id_field: ИД позиции, 'quantity': количество}, ...].
+    Возвращает {ИД позиции: количество} и ошибки {номер строки: текст}
+    """
+    lines, errors = {}, {}
+    if not isinstance(items, list):
+        return lines, {0: 'Items must be a list'}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors[index] = 'Item must be an object'
+        elif type(item.get(id_field)) != int:
+            errors[index] = f'{id_field} must be an integer'
+        elif type(item.get('quantity')) != int or item['quantity'] < 1:
+            errors[index] = 'quantity must be a positive integer'
+        elif item[id_field] in lines:
+            errors[index] = f'Duplicate {id_field}'
+        else:
+            lines[item[id_field]] = item['quantity']
+    return lines, errors
+
+
+def check_available(lines, errors, items, id_field):
+    """
+    Отбрасывает строки с позициями, которых нет или магазин которых не принимает заказы.
+    Возвращает цену и магазин оставшихся позиций
+    """
+    infos = {info_id: (price, shop_id, shop_name) for info_id, price, shop_id, shop_name in
+             ProductInfo.objects.filter(id__in=list(lines), shop__state=True).values_list(
+                 'id', 'price', 'shop_id', 'shop__name')}
+    for index, item in enumerate(items):
+        if index not in errors and item[id_field] not in infos:
+            errors[index] = 'Product not found or shop is not active'
+            del lines[item[id_field]]
+    return infos
+
+
+def add_items(user_id, items):
+    """
+    Добавляет позиции в корзину, у уже лежащих в корзине позиций заменяет количество
+    """
+    lines, errors = parse_lines(items, 'product_info')
+    infos = check_available(lines, errors, items, 'product_info')
+    created = updated = 0
+    if lines:
+        changes = defaultdict(lambda: ('', 0, 0, 0))
+        with transaction.atomic():
+            basket_id = lock_basket(user_id)
+            existing = list(OrderItem.objects.filter(order_id=basket_id, product_info_id__in=list(lines)))
+            for order_item in existing:
+                quantity = lines.pop(order_item.product_info_id)
+                add_change(changes, infos[order_item.product_info_id], 0, quantity - order_item.quantity)
+                order_item.quantity = quantity
+            OrderItem.objects.bulk_update(existing, ['quantity'])
+            OrderItem.objects.bulk_create([OrderItem(order_id=basket_id, product_info_id=info_id,
+                                                     shop_id=infos[info_id][1], quantity=quantity)
+                                           for info_id, quantity in lines.items()])
+            for info_id, quantity in lines.items():
+                add_change(changes, infos[info_id], 1, quantity)
+            update_summary(user_id, basket_id, changes)
+        created, updated = len(lines), len(existing)
+    return created, updated, errors
+
+
+def update_items(user_id, items):
+    """
+    Меняет количество позиций, уже лежащих в корзине
+    """
+    lines, errors = parse_lines(items, 'id')
+    infos = check_available(lines, errors, items, 'id')
+    updated = 0
+    if lines:
+        changes = defaultdict(lambda: ('', 0, 0, 0))
+        with transaction.atomic():
+            basket_id = lock_basket(user_id)
+            existing = list(OrderItem.objects.filter(order_id=basket_id, product_info_id__in=list(lines)))
+            for order_item in existing:
+                quantity = lines[order_item.product_info_id]
+                add_change(changes, infos[order_item.product_info_id], 0, quantity - order_item.quantity)
+                order_item.quantity = quantity
+            updated = OrderItem.objects.bulk_update(existing, ['quantity'])
+            update_summary(user_id, basket_id, changes)
+        in_basket = {order_item.product_info_id for order_item in existing}
+        for index, item in enumerate(items):
+            if index not in errors and item['id'] not in in_basket:
+                errors[index] = 'Product is not in the basket'
+    return updated, errors
+
+
+def delete_items(user_id, items):
+    """
+    Удаляет позиции из корзины одним запросом
+    """
+    errors = {}
+    if not isinstance(items, list):
+        return 0, {0: 'Items must be a list'}
+    ids = set()
+    for index, item_id in enumerate(items):
+        if type(item_id) != int:
+            errors[index] = 'Item must be an integer'
+        else:
+            ids.add(item_id)
+    deleted = 0
+    if ids:
+        changes = defaultdict(lambda: ('', 0, 0, 0))
+        with transaction.atomic():
+            basket_id = lock_basket(user_id)
+            existing = list(OrderItem.objects.filter(order_id=basket_id, product_info_id__in=ids).values_list(
+                'id', 'quantity', 'product_info__price', 'product_info__shop_id', 'product_info__shop__name'))
+            for _, quantity, price, shop_id, shop_name in existing:
+                add_change(changes, (price, shop_id, shop_name), -1, -quantity)
+            deleted = OrderItem.objects.filter(id__in=[row[0] for row in existing]).delete()[0]
+            update_summary(user_id, basket_id, changes)
+    return deleted, errors
+
+
+def place_order(user_id, order_id, contact_id, partial=False):
+    """
+    Размещает заказ из корзины и резервирует остатки.
+    Без partial заказ с нехваткой остатка отклоняется целиком, с partial количество строк уменьшается
+    до доступного, а строки без остатка удаляются. Возвращает нехватки [{product_info, requested, reserved}]
+    """
+    with transaction.atomic():
+        basket = Order.objects.select_for_update().filter(id=order_id, user_id=user_id, status='basket').first()
+        if basket is None:
+            raise OrderPlacementError('Basket not found')
+        if not Contact.objects.filter(id=contact_id, user_id=user_id).exists():
+            raise OrderPlacementError('Contact not found')
+        order_items = list(OrderItem.objects.filter(order_id=order_id).order_by('product_info_id'))
+        if not order_items:
+            raise OrderPlacementError('Basket is empty')
+
+        # строки остатков блокируются в порядке ИД, поэтому одновременные заказы не взаимоблокируются
+        locked = ProductInfo.objects.select_for_update().filter(
+            id__in=[order_item.product_info_id for order_item in order_items]).order_by('id').values_list(
+            'id', 'quantity', 'price')
+        stock, prices = {}, {}
+        for info_id, quantity, price in locked:
+            stock[info_id], prices[info_id] = quantity, price
+        shortages = [{'product_info': order_item.product_info_id, 'requested': order_item.quantity,
+                      'reserved': stock.get(order_item.product_info_id, 0)}
+                     for order_item in order_items if order_item.quantity > stock.get(order_item.product_info_id, 0)]
+        if shortages and not partial:
+            raise OrderPlacementError('Not enough stock', shortages)
+        reserved = [order_item for order_item in order_items if stock.get(order_item.product_info_id)]
+        if not reserved:
+            raise OrderPlacementError('Not enough stock', shortages)
+
+        # цена позиции фиксируется в заказе, последующий импорт не меняет его сумму
+        for order_item in reserved:
+            order_item.quantity = min(order_item.quantity, stock[order_item.product_info_id])
+            order_item.price = prices[order_item.product_info_id]
+            stock[order_item.product_info_id] -= order_item.quantity
+        if len(reserved) < len(order_items):
+            OrderItem.objects.filter(order_id=order_id).exclude(
+                id__in=[order_item.id for order_item in reserved]).delete()
+        OrderItem.objects.bulk_update(reserved, ['quantity', 'price'])
+        reserved_stock = {order_item.product_info_id: stock[order_item.product_info_id] for order_item in reserved}
+        ProductInfo.objects.bulk_update([ProductInfo(id=info_id, quantity=quantity)
+                                         for info_id, quantity in reserved_stock.items()], ['quantity'])
+        CatalogEntry.objects.bulk_update([CatalogEntry(product_info_id=info_id, quantity=quantity)
+                                          for info_id, quantity in reserved_stock.items()], ['quantity'])
+        basket.status = 'new'
+        basket.contact_id = contact_id
+        basket.total_sum = sum(order_item.quantity * order_item.price for order_item in reserved)
+        basket.save(update_fields=['status', 'contact', 'total_sum'])
+    forget_basket(user_id, order_id)
+    return shortages
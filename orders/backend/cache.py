@@ -0,0 +1,97 @@
+"""
+Кэш ответов публичных списков каталога.
+
+Ключ ответа содержит текущую версию каталога, поэтому импорт прайса или смена статуса магазина
+увеличивают версию, и все ранее сохраненные ответы перестают использоваться, не дожидаясь
+окончания времени жизни. Версия каталога передается клиенту в ETag.
+
+Версия хранится в том же кэше и увеличивается в воркере Celery после импорта, поэтому кэш
+каталога должен быть общим для веб-процессов и воркеров (CATALOG_CACHE_BACKEND 'file' или 'redis').
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.cache import quote_etag
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+CACHE_ALIAS = 'catalog'
+VERSION_KEY = 'version'
+NO_CACHE = DummyCache(CACHE_ALIAS, {})
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def get_shared_cache():
+    """
+    Кэш каталога, если он общий для процессов. Вместо кэша в памяти процесса (locmem при DEBUG)
+    возвращается кэш-заглушка, иначе другие процессы читали бы устаревшие данные
+    """
+    cache = get_cache()
+    return NO_CACHE if isinstance(cache, LocMemCache) else cache
+
+
+def get_catalog_version():
+    cache = get_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # начальная версия по времени, чтобы после потери ключа не вернуться к старой версии
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    """
+    Сбрасывает закэшированные ответы каталога
+    """
+    cache = get_cache()
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        version = time.time_ns()
+        cache.set(VERSION_KEY, version, None)
+        return version
+
+
+def request_key(request):
+    """
+    Ключ запроса: путь и отсортированные параметры строки запроса
+    """
+    query = sorted((key, value) for key in request.query_params for value in request.query_params.getlist(key))
+    return hashlib.md5(f'{request.get_host()}{request.path}?{query}'.encode()).hexdigest()
+
+
+def cache_catalog_response(method):
+    """
+    Декоратор метода get: отдает сохраненные данные ответа текущей версии каталога
+    и 304 Not Modified, если клиент прислал актуальный ETag
+    """
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        version = get_catalog_version()
+        key = request_key(request)
+        etag = quote_etag(f'{version}-{key}')
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        cache = get_cache()
+        cache_key = f'response:{version}:{key}'
+        data = cache.get(cache_key)
+        if data is None:
+            response = method(self, request, *args, **kwargs)
+            if not isinstance(response, Response) or response.status_code != status.HTTP_200_OK:
+                return response
+            cache.set(cache_key, response.data)
+        else:
+            response = Response(data)
+        response['ETag'] = etag
+        return response
+    return wrapper
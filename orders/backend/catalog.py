@@ -0,0 +1,145 @@
+"""
+Витрина каталога товаров: обновление, фильтры и фасеты
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Count, Exists, F, Func, Max, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from backend.models import CatalogEntry, Category, Parameter, ProductInfo, ProductParameter, Shop
+from backend.search import update_search_vectors
+
+ID_FILTERS = {
+    'shop_id': 'shop_id',
+    'category_id': 'category_id',
+}
+
+RANGE_FILTERS = {
+    'price_min': 'price__gte',
+    'price_max': 'price__lte',
+    'price_rrc_min': 'price_rrc__gte',
+    'price_rrc_max': 'price_rrc__lte',
+}
+
+
+def refresh_catalog_entries(info_ids):
+    """
+    Пересобирает позиции витрины для переданных ИД ProductInfo, удаленные позиции пропадают из витрины
+    """
+    info_ids = list(set(info_ids))
+    if not info_ids:
+        return
+    parameters = defaultdict(list)
+    for info_id, name, value in ProductParameter.objects.filter(product_info_id__in=info_ids).order_by(
+            'id').values_list('product_info_id', 'parameter__name', 'value'):
+        parameters[info_id].append({'parameter': name, 'value': value})
+    entries = [CatalogEntry(product_info_id=info_id, shop_id=shop_id, shop_name=shop_name, shop_state=shop_state,
+                            category_id=category_id, category_name=category_name, product_name=product_name,
+                            external_id=external_id, model=model, quantity=quantity, price=price,
+                            price_rrc=price_rrc, parameters=parameters[info_id])
+               for info_id, shop_id, shop_name, shop_state, category_id, category_name, product_name, external_id,
+               model, quantity, price, price_rrc in ProductInfo.objects.filter(id__in=info_ids).values_list(
+                   'id', 'shop_id', 'shop__name', 'shop__state', 'product__category_id', 'product__category__name',
+                   'product__name', 'external_id', 'model', 'quantity', 'price', 'price_rrc')]
+    CatalogEntry.objects.filter(product_info_id__in=info_ids).delete()
+    CatalogEntry.objects.bulk_create(entries)
+    update_search_vectors(info_ids)
+
+
+def rebuild_catalog(chunk_size=None):
+    """
+    Полная пересборка витрины пачками по ИД позиций
+    """
+    chunk_size = chunk_size or settings.IMPORT_BATCH_SIZE
+    CatalogEntry.objects.exclude(product_info_id__in=ProductInfo.objects.values('id')).delete()
+    last_id = 0
+    while True:
+        info_ids = list(ProductInfo.objects.filter(id__gt=last_id).order_by('id').values_list(
+            'id', flat=True)[:chunk_size])
+        if not info_ids:
+            return
+        refresh_catalog_entries(info_ids)
+        last_id = info_ids[-1]
+
+
+def subquery_count(queryset):
+    """
+    Коррелированный подзапрос с числом строк queryset, без GROUP BY во внешнем запросе
+    """
+    return Coalesce(Subquery(queryset.order_by().annotate(
+        count=Func(F('pk'), function='COUNT')).values('count')), 0)
+
+
+def categories_with_counts():
+    """
+    Категории с магазинами одним prefetch-запросом, числом активных магазинов и предложений в них
+    """
+    return Category.objects.prefetch_related('shops').annotate(
+        active_shops=subquery_count(Shop.objects.filter(categories=OuterRef('pk'), state=True)),
+        offers=subquery_count(CatalogEntry.objects.filter(category_id=OuterRef('pk'), shop_state=True)),
+    ).order_by('id')
+
+
+class CatalogFilterError(ValueError):
+    """
+    Неверный параметр фильтра каталога
+    """
+
+
+def parse_parameter_filters(values):
+    """
+    Фильтры вида parameter=<имя>:<значение>, значения одного параметра объединяются через ИЛИ
+    """
+    filters = defaultdict(set)
+    for value in values:
+        name, separator, parameter_value = value.partition(':')
+        if not separator or not name:
+            raise CatalogFilterError(f'Parameter filter must look like <name>:<value>, got {value!r}')
+        filters[name].add(parameter_value)
+    return filters
+
+
+def filter_products(queryset, params):
+    """
+    Фильтрует позиции витрины по магазину, категории, диапазонам цен и значениям параметров
+    """
+    lookups = {}
+    for param, lookup in list(ID_FILTERS.items()) + list(RANGE_FILTERS.items()):
+        value = params.get(param)
+        if value in (None, ''):
+            continue
+        try:
+            lookups[lookup] = int(value)
+        except ValueError:
+            raise CatalogFilterError(f'{param} must be an integer')
+    queryset = queryset.filter(**lookups)
+
+    parameter_filters = parse_parameter_filters(params.getlist('parameter'))
+    if parameter_filters:
+        parameter_ids = dict(Parameter.objects.filter(name__in=parameter_filters).values_list('name', 'id'))
+        for name, values in parameter_filters.items():
+            queryset = queryset.filter(Exists(ProductParameter.objects.filter(
+                product_info_id=OuterRef('pk'), parameter_id=parameter_ids.get(name), value__in=values)))
+    return queryset
+
+
+def product_facets(queryset, limit=None):
+    """
+    Количество позиций по магазинам, категориям и значениям параметров, диапазон цен
+    """
+    limit = limit or settings.PRODUCTS_FACET_LIMIT
+    queryset = queryset.order_by()
+    parameters = defaultdict(list)
+    for row in ProductParameter.objects.filter(product_info_id__in=queryset.values('pk')).values(
+            'value', name=F('parameter__name')).annotate(count=Count('id')).order_by('-count', 'name', 'value')[:limit]:
+        parameters[row['name']].append({'value': row['value'], 'count': row['count']})
+    return {
+        'shops': list(queryset.values('shop_id', name=F('shop_name')).annotate(
+            count=Count('pk')).order_by('-count', 'shop_id')),
+        'categories': list(queryset.values('category_id', name=F('category_name')).annotate(
+            count=Count('pk')).order_by('-count', 'category_id')),
+        'price': queryset.aggregate(min=Min('price'), max=Max('price')),
+        'price_rrc': queryset.aggregate(min=Min('price_rrc'), max=Max('price_rrc')),
+        'parameters': parameters,
+    }
@@ -0,0 +1,100 @@
+"""
+Потоковая выгрузка каталога магазина.
+
+YAML и JSON Lines выгружаются в той же схеме, что читает импорт, CSV - по строке на позицию
+с параметрами в виде JSON. Позиции читаются пачками по ИД, поэтому каталог целиком
+в памяти не собирается.
+"""
+import csv
+import io
+import json
+import yaml
+from django.conf import settings
+
+from backend.models import CatalogEntry
+
+try:
+    from yaml import CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeDumper
+
+CSV_COLUMNS = ('id', 'category', 'model', 'name', 'price', 'price_rrc', 'quantity', 'parameters')
+
+EXPORT_FORMATS = {
+    'yaml': 'application/x-yaml',
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def iter_goods(shop, chunk_size=None):
+    """
+    Товары магазина в схеме прайса, пачками по chunk_size: позиции витрины читаются по ИД
+    после последней выгруженной, параметры уже лежат в позиции
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    queryset = CatalogEntry.objects.filter(shop_id=shop.id).order_by('pk').values_list(
+        'pk', 'external_id', 'category_id', 'model', 'product_name', 'price', 'price_rrc', 'quantity', 'parameters')
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_id)[:chunk_size])
+        if not rows:
+            return
+        yield [{'id': external_id, 'category': category_id, 'model': model, 'name': name, 'price': price,
+                'price_rrc': price_rrc, 'quantity': quantity,
+                'parameters': {parameter['parameter']: parameter['value'] for parameter in parameters}}
+               for _, external_id, category_id, model, name, price, price_rrc, quantity, parameters in rows]
+        last_id = rows[-1][0]
+
+
+def get_header(shop):
+    return {'shop': shop.name,
+            'categories': [{'id': category_id, 'name': name} for category_id, name in
+                           shop.categories.order_by('id').values_list('id', 'name')]}
+
+
+def dump_yaml(data):
+    return yaml.dump(data, Dumper=SafeDumper, allow_unicode=True, sort_keys=False)
+
+
+def export_yaml(shop, chunk_size=None):
+    yield dump_yaml(get_header(shop))
+    yield 'goods:\n'
+    for goods in iter_goods(shop, chunk_size):
+        yield dump_yaml(goods)
+
+
+def export_json_lines(shop, chunk_size=None):
+    yield json.dumps(get_header(shop), ensure_ascii=False) + '\n'
+    for goods in iter_goods(shop, chunk_size):
+        yield ''.join(json.dumps(good, ensure_ascii=False) + '\n' for good in goods)
+
+
+def export_csv(shop, chunk_size=None):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for goods in iter_goods(shop, chunk_size):
+        for good in goods:
+            writer.writerow([json.dumps(good[column], ensure_ascii=False) if column == 'parameters' else good[column]
+                             for column in CSV_COLUMNS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+EXPORTERS = {
+    'yaml': export_yaml,
+    'csv': export_csv,
+    'jsonl': export_json_lines,
+}
+
+
+def export_catalog(shop, export_format='yaml', chunk_size=None):
+    """
+    Генератор текстовых фрагментов выгрузки каталога магазина
+    """
+    if export_format not in EXPORTERS:
+        raise ValueError(f'Unknown export format: {export_format}')
+    return EXPORTERS[export_format](shop, chunk_size)
@@ -0,0 +1,153 @@
+"""
+Загрузка прайс-листов поставщиков по ссылке Shop.url.
+
+Прайс запрашивается условным запросом (If-None-Match / If-Modified-Since), а скачанное
+содержимое сравнивается по sha256 с последним импортированным, чтобы не разбирать
+неизменившиеся прайсы.
+
+Ссылку задает магазин, поэтому загружаются только http/https адреса, которые разрешаются
+в публичные IP (проверяется и каждый редирект). Локальные файлы доступны только
+с FEED_ALLOW_LOCAL_FILES.
+"""
+import hashlib
+import ipaddress
+import logging
+import os
+import socket
+import tempfile
+from pathlib import Path
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlparse
+from urllib.request import HTTPRedirectHandler, Request, build_opener
+
+from django.conf import settings
+
+from backend.models import Shop
+from backend.parsers import detect_format
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+# прайсы до этого размера держим в памяти, большие сбрасываются во временный файл
+SPOOL_MAX_SIZE = 10 * 1024 * 1024
+
+
+class Feed:
+    """
+    Скачанный прайс-лист
+    """
+    def __init__(self, file, fmt, content_hash, etag='', last_modified=''):
+        self.file = file
+        self.format = fmt
+        self.content_hash = content_hash
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.file.close()
+
+    def is_changed(self, shop):
+        return self.content_hash != shop.feed_hash
+
+    def remember(self, shop):
+        """
+        Сохраняет валидаторы и хэш прайса для следующего условного запроса
+        """
+        shop.feed_etag = self.etag
+        shop.feed_last_modified = self.last_modified
+        shop.feed_hash = self.content_hash
+        Shop.objects.filter(id=shop.id).update(feed_etag=self.etag, feed_last_modified=self.last_modified,
+                                               feed_hash=self.content_hash)
+
+
+class FeedURLError(ValueError):
+    """
+    Ссылка на прайс недопустима
+    """
+
+
+class FeedError(Exception):
+    """
+    Прайс не удалось скачать
+    """
+
+
+def check_host(host, port):
+    """
+    Проверяет, что все адреса хоста публичные
+    """
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError):
+        raise FeedURLError(f'Cannot resolve host: {host}')
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%')[0])
+        if not ip.is_global or ip.is_multicast:
+            raise FeedURLError(f'Host is not allowed: {host}')
+
+
+def feed_url(url):
+    """
+    Проверяет ссылку на прайс и возвращает адрес для загрузки
+    """
+    if len(url) > Shop._meta.get_field('url').max_length:
+        raise FeedURLError(f'URL is longer than {Shop._meta.get_field("url").max_length} characters')
+    parsed = urlparse(url)
+    if parsed.scheme in ('', 'file') and settings.FEED_ALLOW_LOCAL_FILES:
+        # ссылка без схемы считается путем к локальному файлу
+        return url if parsed.scheme else Path(os.path.abspath(url)).as_uri()
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise FeedURLError('Only http and https URLs are allowed')
+    try:
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+    except ValueError:
+        raise FeedURLError('Invalid port')
+    check_host(parsed.hostname, port)
+    return url
+
+
+class FeedRedirectHandler(HTTPRedirectHandler):
+    """
+    Переходит по редиректу только на допустимую ссылку
+    """
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        if urlparse(newurl).scheme not in ('http', 'https'):
+            raise FeedURLError('Only http and https URLs are allowed')
+        feed_url(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+def fetch_feed(shop, timeout=None):
+    """
+    Скачивает прайс магазина. Возвращает None, если сервер ответил 304 Not Modified
+    """
+    url = feed_url(shop.url)
+    request = Request(url)
+    if shop.feed_etag:
+        request.add_header('If-None-Match', shop.feed_etag)
+    if shop.feed_last_modified:
+        request.add_header('If-Modified-Since', shop.feed_last_modified)
+    try:
+        response = build_opener(FeedRedirectHandler).open(request, timeout=timeout or settings.FEED_TIMEOUT)
+    except HTTPError as error:
+        if error.code == 304:
+            return None
+        raise FeedError(f'Price list download failed: HTTP {error.code}')
+    except (URLError, OSError) as error:
+        # подробности ошибки соединения остаются в логе, в статус задачи импорта они не попадают
+        logger.warning('Price list download for shop %s failed: %s', shop.id, error)
+        raise FeedError('Price list download failed')
+
+    digest = hashlib.sha256()
+    file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    with response:
+        for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            file.write(chunk)
+        headers = response.headers
+    file.seek(0)
+    return Feed(file, detect_format(urlparse(url).path), digest.hexdigest(),
+                etag=headers.get('ETag', ''), last_modified=headers.get('Last-Modified', ''))
@@ -0,0 +1,490 @@
+"""
+Импорт прайс-листов поставщиков
+"""
+import csv
+import io
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from backend.basket import mark_summaries_stale
+from backend.catalog import refresh_catalog_entries
+from backend.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter, CatalogEntry
+from backend.parsers import PriceListFormatError
+
+logger = logging.getLogger(__name__)
+
+
+def chunked(iterable, size):
+    """
+    Разбивает итерируемый объект на списки не длиннее size
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+@contextmanager
+def shop_import_lock(shop_id, ttl=None):
+    """
+    Блокировка импорта магазина на время ttl секунд, отдает True, если блокировка получена.
+
+    Блокировка - условный UPDATE поля Shop.import_lock_until, поэтому работает между воркерами,
+    а просроченная блокировка упавшего воркера снимается сама.
+    """
+    now = timezone.now()
+    acquired = Shop.objects.filter(Q(import_lock_until__isnull=True) | Q(import_lock_until__lt=now), id=shop_id).update(
+        import_lock_until=now + timedelta(seconds=ttl or settings.IMPORT_LOCK_TTL))
+    try:
+        yield bool(acquired)
+    finally:
+        if acquired:
+            Shop.objects.filter(id=shop_id).update(import_lock_until=None)
+
+
+class NameCache:
+    """
+    Словарь ключ -> ИД записей модели на время одного импорта.
+
+    Прогревается одним запросом, промахи добираются из базы и создаются через bulk_create,
+    после чего новые ИД сразу попадают в словарь.
+    """
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+        self.ids = {}
+
+    def warm(self, queryset=None):
+        queryset = self.model.objects.all() if queryset is None else queryset
+        for row in queryset.order_by('-id').values_list('id', *self.fields):
+            self.ids[self._key(row[1:])] = row[0]
+        return self
+
+    def resolve(self, keys):
+        missing = set(keys) - self.ids.keys()
+        if missing:
+            self._load(missing)
+            missing -= self.ids.keys()
+        if missing:
+            objects = {key: self.model(**self._values(key)) for key in missing}
+            self.model.objects.bulk_create(objects.values())
+            if any(obj.pk is None for obj in objects.values()):
+                self._load(missing)
+            else:
+                self.ids.update((key, obj.pk) for key, obj in objects.items())
+        return self.ids
+
+    def _load(self, keys):
+        lookups = {f'{field}__in': {self._values(key)[field] for key in keys} for field in self.fields}
+        for row in self.model.objects.filter(**lookups).values_list('id', *self.fields):
+            key = self._key(row[1:])
+            if key in keys:
+                self.ids.setdefault(key, row[0])
+
+    def _key(self, values):
+        return values[0] if len(self.fields) == 1 else tuple(values)
+
+    def _values(self, key):
+        return dict(zip(self.fields, (key,) if len(self.fields) == 1 else key))
+
+
+class PriceListImporter:
+    """
+    Пакетный импорт прайс-листа одного магазина с полной перезаписью позиций.
+
+    Категории, товары и параметры разрешаются несколькими запросами на пачку товаров,
+    ProductInfo и ProductParameter записываются через bulk_create/bulk_update.
+    Позиции, которых больше нет в прайсе, удаляются в finish().
+    """
+    mode = 'full'
+    info_fields = ('model', 'quantity', 'price', 'price_rrc')
+
+    def __init__(self, shop, batch_size=None, progress=None):
+        self.shop = shop
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.progress = progress
+        self.stats = {'shop': shop.id, 'mode': self.mode, 'rows': 0, 'created': 0, 'updated': 0, 'deleted': 0}
+        self._seen = set()
+        self.products = NameCache(Product, ('name', 'category_id'))
+        self.parameters = NameCache(Parameter, ('name',))
+
+    def run(self, categories, goods):
+        """
+        Импортирует категории и товары в одной транзакции и возвращает статистику
+        """
+        started = time.monotonic()
+        with transaction.atomic():
+            self.import_categories(categories)
+            self.import_goods(goods)
+            self.finish()
+        seconds = time.monotonic() - started
+        self.stats['seconds'] = round(seconds, 3)
+        self.stats['rows_per_sec'] = round(self.stats['rows'] / seconds, 1) if seconds else 0
+        logger.info('Import of shop %s: %s rows in %.3fs (%s rows/sec)', self.shop.id, self.stats['rows'],
+                    seconds, self.stats['rows_per_sec'])
+        return self.stats
+
+    def import_categories(self, categories):
+        names = {int(category['id']): category['name'] for category in categories}
+        existing = Category.objects.in_bulk(list(names))
+        Category.objects.bulk_create([Category(id=category_id, name=name) for category_id, name in names.items()
+                                      if category_id not in existing])
+        self.shop.categories.add(*names)
+        # товары почти всегда из категорий прайса, остальные добираются из базы при промахе
+        self.products.warm(Product.objects.filter(category_id__in=list(names)))
+        self.parameters.warm()
+
+    def import_goods(self, goods):
+        for batch in chunked(goods, self.batch_size):
+            self.write_batch(batch)
+            if self.progress:
+                self.progress(self.stats)
+
+    def write_batch(self, batch):
+        items = {}
+        products = self._resolve_products(batch)
+        for item in batch:
+            product_id = products[(item['name'], int(item['category']))]
+            items[(product_id, int(item['id']))] = item
+        self.stats['rows'] += len(batch)
+        self._seen.update(items)
+
+        existing = {(info.product_id, info.external_id): info for info in ProductInfo.objects.filter(
+            shop_id=self.shop.id, external_id__in={external_id for _, external_id in items})}
+        to_create, to_update = [], []
+        for key, item in items.items():
+            info = existing.get(key)
+            if info is None:
+                info = ProductInfo(product_id=key[0], shop_id=self.shop.id, external_id=key[1])
+                to_create.append(info)
+            else:
+                to_update.append(info)
+            info.model = item['model']
+            info.quantity = item['quantity']
+            info.price = item['price']
+            info.price_rrc = item.get('price_rrc', 0)
+
+        ProductInfo.objects.bulk_create(to_create)
+        ProductInfo.objects.bulk_update(to_update, self.info_fields)
+        self.stats['created'] += len(to_create)
+        self.stats['updated'] += len(to_update)
+
+        info_ids = self._info_ids(items)
+        ProductParameter.objects.filter(product_info_id__in=[info.id for info in to_update]).delete()
+        self._write_parameters({info_ids[key]: item.get('parameters') or {} for key, item in items.items()})
+        written = [info_ids[key] for key in items]
+        refresh_catalog_entries(written)
+        mark_summaries_stale(written)
+
+    def finish(self):
+        """
+        Удаляет позиции магазина, отсутствующие в импортированном прайсе
+        """
+        stale = [info_id for info_id, product_id, external_id in ProductInfo.objects.filter(
+            shop_id=self.shop.id).values_list('id', 'product_id', 'external_id')
+            if (product_id, external_id) not in self._seen]
+        for ids in chunked(stale, self.batch_size):
+            mark_summaries_stale(ids)
+            self.stats['deleted'] += ProductInfo.objects.filter(id__in=ids).delete()[1].get(
+                ProductInfo._meta.label, 0)
+
+    def _resolve_products(self, batch):
+        return self.products.resolve({(item['name'], int(item['category'])) for item in batch})
+
+    def _info_ids(self, keys):
+        return {(product_id, external_id): info_id for info_id, product_id, external_id in ProductInfo.objects.filter(
+            shop_id=self.shop.id, external_id__in={external_id for _, external_id in keys}).values_list(
+            'id', 'product_id', 'external_id')}
+
+    def _write_parameters(self, parameters_by_info):
+        names = {str(name) for parameters in parameters_by_info.values() for name in parameters}
+        parameter_ids = self.parameters.resolve(names)
+        ProductParameter.objects.bulk_create([
+            ProductParameter(product_info_id=info_id, parameter_id=parameter_ids[str(name)], value=value)
+            for info_id, parameters in parameters_by_info.items() for name, value in parameters.items()
+        ], batch_size=self.batch_size)
+
+
+class IncrementalPriceListImporter(PriceListImporter):
+    """
+    Инкрементальный импорт прайс-листа.
+
+    Позиции сопоставляются с существующими по (shop, external_id): создаются только новые,
+    обновляются только изменившиеся цена, остаток, модель или параметры. Позиции, пропавшие
+    из прайса, не удаляются, а снимаются с продажи обнулением остатка, поэтому корзины
+    покупателей не теряют товары.
+    """
+    mode = 'incremental'
+    info_fields = ('product_id', 'model', 'quantity', 'price', 'price_rrc')
+
+    def __init__(self, shop, batch_size=None, progress=None):
+        super().__init__(shop, batch_size, progress)
+        del self.stats['deleted']
+        self.stats.update(unchanged=0, retired=0)
+
+    def write_batch(self, batch):
+        products = self._resolve_products(batch)
+        items = {int(item['id']): item for item in batch}
+        self.stats['rows'] += len(batch)
+        self._seen.update(items)
+
+        existing = {info.external_id: info for info in ProductInfo.objects.filter(
+            shop_id=self.shop.id, external_id__in=list(items))}
+        current_parameters = defaultdict(dict)
+        for info_id, name, value in ProductParameter.objects.filter(
+                product_info_id__in=[info.id for info in existing.values()]).values_list(
+                'product_info_id', 'parameter__name', 'value'):
+            current_parameters[info_id][name] = value
+
+        to_create, to_update, parameters_by_info = [], [], {}
+        for external_id, item in items.items():
+            values = {'product_id': products[(item['name'], int(item['category']))],
+                      'model': item['model'],
+                      'quantity': int(item['quantity']),
+                      'price': int(item['price']),
+                      'price_rrc': int(item.get('price_rrc', 0))}
+            parameters = {str(name): str(value) for name, value in (item.get('parameters') or {}).items()}
+            info = existing.get(external_id)
+            if info is None:
+                to_create.append((ProductInfo(shop_id=self.shop.id, external_id=external_id, **values), parameters))
+                continue
+            changed = False
+            if any(getattr(info, field) != value for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(info, field, value)
+                to_update.append(info)
+                changed = True
+            if current_parameters[info.id] != parameters:
+                parameters_by_info[info.id] = parameters
+                changed = True
+            self.stats['updated' if changed else 'unchanged'] += 1
+
+        ProductInfo.objects.bulk_create([info for info, _ in to_create])
+        ProductInfo.objects.bulk_update(to_update, self.info_fields)
+        ProductParameter.objects.filter(product_info_id__in=list(parameters_by_info)).delete()
+        self.stats['created'] += len(to_create)
+
+        if to_create and to_create[0][0].pk is None:
+            created_ids = dict(ProductInfo.objects.filter(
+                shop_id=self.shop.id, external_id__in=[info.external_id for info, _ in to_create]).values_list(
+                'external_id', 'id'))
+            for info, _ in to_create:
+                info.pk = created_ids[info.external_id]
+        parameters_by_info.update({info.pk: parameters for info, parameters in to_create})
+        self._write_parameters(parameters_by_info)
+        changed = {info.id for info in to_update} | parameters_by_info.keys()
+        refresh_catalog_entries(changed)
+        mark_summaries_stale(changed)
+
+    def finish(self):
+        """
+        Обнуляет остаток позиций магазина, отсутствующих в импортированном прайсе
+        """
+        stale = [info_id for info_id, external_id in ProductInfo.objects.filter(
+            shop_id=self.shop.id, quantity__gt=0).values_list('id', 'external_id')
+            if external_id not in self._seen]
+        for ids in chunked(stale, self.batch_size):
+            self.stats['retired'] += ProductInfo.objects.filter(id__in=ids).update(quantity=0)
+            CatalogEntry.objects.filter(product_info_id__in=ids).update(quantity=0)
+
+
+class CopyPriceListImporter(PriceListImporter):
+    """
+    Импорт через PostgreSQL COPY.
+
+    Пачка товаров копируется через COPY FROM STDIN во временные таблицы и сливается с рабочими
+    одним INSERT ... ON CONFLICT по ограничениям unique_product_info и unique_product_parameter,
+    не изменившиеся строки не перезаписываются. Позиции, которых нет в прайсе, удаляются.
+    """
+    info_columns = ('product_id', 'external_id', 'model', 'quantity', 'price', 'price_rrc')
+    parameter_columns = ('product_id', 'external_id', 'parameter_id', 'value')
+    # поля, по которым позиция прайса сопоставляется с существующей позицией магазина
+    match_columns = ('product_id', 'external_id')
+
+    def __init__(self, shop, batch_size=None, progress=None):
+        super().__init__(shop, batch_size, progress)
+        self.stats.update(backend='copy', unchanged=0)
+
+    def write_batch(self, batch):
+        products = self._resolve_products(batch)
+        items = {}
+        for item in batch:
+            row = {'product_id': products[(item['name'], int(item['category']))], 'external_id': int(item['id'])}
+            items[tuple(row[column] for column in self.match_columns)] = (row, item)
+        self.stats['rows'] += len(batch)
+        self._seen.update(items)
+        parameter_ids = self.parameters.resolve(
+            {str(name) for _, item in items.values() for name in (item.get('parameters') or {})})
+
+        info_rows = [(row['product_id'], row['external_id'], str(item['model']), int(item['quantity']),
+                      int(item['price']), int(item.get('price_rrc', 0))) for row, item in items.values()]
+        parameter_rows = [(row['product_id'], row['external_id'], parameter_ids[str(name)], str(value))
+                          for row, item in items.values()
+                          for name, value in (item.get('parameters') or {}).items()]
+
+        info_table = ProductInfo._meta.db_table
+        parameter_table = ProductParameter._meta.db_table
+        staged_match = ' AND '.join(f'info.{column} = staged.{column}' for column in self.match_columns)
+        staged_param_match = ' AND '.join(f'staged_param.{column} = info.{column}' for column in self.match_columns)
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TEMPORARY TABLE IF NOT EXISTS import_productinfo '
+                           '(product_id bigint, external_id integer, model text, quantity integer, price integer, '
+                           'price_rrc integer) ON COMMIT DROP')
+            cursor.execute('CREATE TEMPORARY TABLE IF NOT EXISTS import_productparameter '
+                           '(product_id bigint, external_id integer, parameter_id bigint, value text) ON COMMIT DROP')
+            cursor.execute('TRUNCATE import_productinfo, import_productparameter')
+            self._copy(cursor, 'import_productinfo', self.info_columns, info_rows)
+            self._copy(cursor, 'import_productparameter', self.parameter_columns, parameter_rows)
+
+            rows = self._merge_infos(cursor, info_table)
+            changed = {info_id for info_id, _ in rows}
+            created = {info_id for info_id, inserted in rows if inserted}
+
+            cursor.execute(f'''
+                DELETE FROM {parameter_table} AS param
+                USING {info_table} AS info, import_productinfo AS staged
+                WHERE param.product_info_id = info.id AND info.shop_id = %s AND {staged_match}
+                    AND NOT EXISTS (
+                        SELECT 1 FROM import_productparameter AS staged_param
+                        WHERE {staged_param_match} AND staged_param.parameter_id = param.parameter_id)
+                RETURNING param.product_info_id
+            ''', [self.shop.id])
+            changed.update(info_id for info_id, in cursor.fetchall())
+            cursor.execute(f'''
+                INSERT INTO {parameter_table} AS param (product_info_id, parameter_id, value)
+                SELECT info.id, staged.parameter_id, staged.value
+                FROM import_productparameter AS staged
+                JOIN {info_table} AS info ON info.shop_id = %s AND {staged_match}
+                ON CONFLICT ON CONSTRAINT unique_product_parameter DO UPDATE SET value = EXCLUDED.value
+                WHERE param.value IS DISTINCT FROM EXCLUDED.value
+                RETURNING param.product_info_id
+            ''', [self.shop.id])
+            changed.update(info_id for info_id, in cursor.fetchall())
+        # позиция с изменившимися только параметрами тоже считается обновленной, как и в импорте через ORM
+        self.stats['created'] += len(created)
+        self.stats['updated'] += len(changed - created)
+        self.stats['unchanged'] += len(items) - len(changed)
+        refresh_catalog_entries(changed)
+        mark_summaries_stale(changed)
+
+    def _merge_infos(self, cursor, info_table):
+        """
+        Записывает новые и изменившиеся позиции, возвращает [(ИД, создана ли)]
+        """
+        cursor.execute(f'''
+            INSERT INTO {info_table} AS info (shop_id, product_id, external_id, model, quantity, price, price_rrc)
+            SELECT %s, product_id, external_id, model, quantity, price, price_rrc FROM import_productinfo
+            ON CONFLICT ON CONSTRAINT unique_product_info DO UPDATE
+            SET model = EXCLUDED.model, quantity = EXCLUDED.quantity, price = EXCLUDED.price,
+                price_rrc = EXCLUDED.price_rrc
+            WHERE (info.model, info.quantity, info.price, info.price_rrc)
+                IS DISTINCT FROM (EXCLUDED.model, EXCLUDED.quantity, EXCLUDED.price, EXCLUDED.price_rrc)
+            RETURNING id, xmax = 0
+        ''', [self.shop.id])
+        return cursor.fetchall()
+
+    @staticmethod
+    def _copy(cursor, table, columns, rows):
+        buffer = io.StringIO()
+        # строки в кавычках, чтобы пустая строка не превратилась в NULL
+        csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows(rows)
+        buffer.seek(0)
+        cursor.copy_expert(f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+class IncrementalCopyPriceListImporter(CopyPriceListImporter):
+    """
+    Инкрементальный импорт через PostgreSQL COPY.
+
+    Как и IncrementalPriceListImporter, позиции сопоставляются по (shop, external_id), поэтому
+    переименованный в прайсе товар обновляет product_id существующей позиции. Позиции, которых
+    нет в прайсе, снимаются с продажи обнулением остатка
+    """
+    mode = 'incremental'
+    match_columns = ('external_id',)
+
+    def __init__(self, shop, batch_size=None, progress=None):
+        super().__init__(shop, batch_size, progress)
+        del self.stats['deleted']
+        self.stats['retired'] = 0
+
+    def _merge_infos(self, cursor, info_table):
+        # уникального ограничения по (shop, external_id) нет, поэтому UPDATE существующих и INSERT новых;
+        # одновременный импорт магазина исключен блокировкой shop_import_lock
+        cursor.execute(f'''
+            UPDATE {info_table} AS info
+            SET product_id = staged.product_id, model = staged.model, quantity = staged.quantity,
+                price = staged.price, price_rrc = staged.price_rrc
+            FROM import_productinfo AS staged
+            WHERE info.shop_id = %s AND info.external_id = staged.external_id
+                AND (info.product_id, info.model, info.quantity, info.price, info.price_rrc)
+                    IS DISTINCT FROM (staged.product_id, staged.model, staged.quantity, staged.price, staged.price_rrc)
+            RETURNING info.id, false
+        ''', [self.shop.id])
+        rows = cursor.fetchall()
+        cursor.execute(f'''
+            INSERT INTO {info_table} (shop_id, product_id, external_id, model, quantity, price, price_rrc)
+            SELECT %s, product_id, external_id, model, quantity, price, price_rrc FROM import_productinfo AS staged
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {info_table} AS info WHERE info.shop_id = %s AND info.external_id = staged.external_id)
+            RETURNING id, true
+        ''', [self.shop.id, self.shop.id])
+        return rows + cursor.fetchall()
+
+    def finish(self):
+        stale = [info_id for info_id, external_id in ProductInfo.objects.filter(
+            shop_id=self.shop.id, quantity__gt=0).values_list('id', 'external_id')
+            if (external_id,) not in self._seen]
+        for ids in chunked(stale, self.batch_size):
+            self.stats['retired'] += ProductInfo.objects.filter(id__in=ids).update(quantity=0)
+            CatalogEntry.objects.filter(product_info_id__in=ids).update(quantity=0)
+
+
+IMPORTERS = {
+    PriceListImporter.mode: PriceListImporter,
+    IncrementalPriceListImporter.mode: IncrementalPriceListImporter,
+}
+
+COPY_IMPORTERS = {
+    CopyPriceListImporter.mode: CopyPriceListImporter,
+    IncrementalCopyPriceListImporter.mode: IncrementalCopyPriceListImporter,
+}
+
+
+def get_importer_class(mode=None, backend=None):
+    """
+    Класс импорта для режима mode и бэкенда записи backend ('orm' или 'copy').
+    COPY доступен только в PostgreSQL, на других базах используется пакетная запись через ORM
+    """
+    mode = mode or settings.IMPORT_MODE
+    if mode not in IMPORTERS:
+        raise ValueError(f'Unknown import mode: {mode}')
+    if (backend or settings.IMPORT_BACKEND) == 'copy':
+        if connection.vendor == 'postgresql':
+            return COPY_IMPORTERS[mode]
+        logger.warning('COPY import backend requires PostgreSQL, falling back to ORM bulk import')
+    return IMPORTERS[mode]
+
+
+def import_price_list(data, shop=None, batch_size=None, mode=None, progress=None, backend=None):
+    """
+    Импортирует прайс-лист, магазин по умолчанию ищется по имени из файла.
+    progress вызывается со статистикой после каждой записанной пачки
+    """
+    importer_class = get_importer_class(mode, backend)
+    if shop is None:
+        if not data.get('shop'):
+            raise PriceListFormatError("Price list has no 'shop'")
+        shop, _ = Shop.objects.get_or_create(name=data['shop'])
+    return importer_class(shop, batch_size, progress).run(data['categories'], data['goods'])
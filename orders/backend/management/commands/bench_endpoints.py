@@ -0,0 +1,200 @@
+import json
+import math
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from urllib.parse import urlencode
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, \
+    teardown_test_environment
+from django.urls import get_resolver, reverse
+from rest_framework.authtoken.models import Token
+
+from backend.cache import get_cache
+from backend.importer import import_price_list
+from backend.models import Contact, ImportJob, Order, OrderItem, ProductInfo, Shop, User
+from backend.synthetic import generate_price_list, write_price_list
+from orders.celery import celery_app
+
+PASSWORD = 'bench-Passw0rd'
+
+# (название, имя url, аргументы url, параметры строки запроса, метод, данные, пользователь)
+ENDPOINTS = (
+    ('categories', 'categories', {}, {}, 'get', None, None),
+    ('shops', 'shops', {}, {}, 'get', None, None),
+    ('products', 'products', {}, {}, 'get', None, None),
+    ('products-search', 'products', {}, {'product_name': 'samsung pro'}, 'get', None, None),
+    ('products-filter', 'products', {}, {'category_id': 1, 'price_min': 1000, 'parameter': 'Цвет:черный'},
+     'get', None, None),
+    ('products-offset', 'products', {}, {'offset': 500}, 'get', None, None),
+    ('user-login', 'user-login', {}, {}, 'post', {'email': 'buyer@bench.local', 'password': PASSWORD}, None),
+    ('user-register', 'user-register', {}, {}, 'post', {}, None),
+    ('user-register-confirm', 'user-register-confirm', {}, {}, 'post',
+     {'email': 'buyer@bench.local', 'token': 'invalid'}, None),
+    ('user-contact', 'user-contact', {}, {}, 'get', None, 'buyer'),
+    ('user-account', 'user-account', {}, {}, 'get', None, 'buyer'),
+    ('password-reset', 'password-reset', {}, {}, 'post', {'email': 'nobody@bench.local'}, None),
+    ('password-reset-confirm', 'password-reset-confirm', {}, {}, 'post',
+     {'token': 'invalid', 'password': PASSWORD}, None),
+    ('partner-update', 'partner-update', {}, {}, 'post', {}, 'shop'),
+    ('partner-update-job', 'partner-update-job', {'job_id': 'job_id'}, {}, 'get', None, 'shop'),
+    ('partner-export', 'partner-export', {}, {'export_format': 'jsonl'}, 'get', None, 'shop'),
+    ('partner-state', 'partner-state', {}, {}, 'get', None, 'shop'),
+    ('partner-orders', 'partner-orders', {}, {}, 'get', None, 'shop'),
+    ('basket', 'basket', {}, {}, 'get', None, 'buyer'),
+    ('order', 'order', {}, {}, 'get', None, 'buyer'),
+    ('admin', None, {}, {}, 'get', None, None),
+)
+
+METRICS = ('p95_ms', 'queries', 'peak_memory_kb')
+# разница меньше этих значений считается шумом замера
+NOISE = {'p95_ms': 1.0, 'queries': 0, 'peak_memory_kb': 64}
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[max(0, math.ceil(len(values) * percent / 100) - 1)]
+
+
+def compare(report, baseline, threshold):
+    """
+    Метрики, выросшие относительно baseline больше чем на threshold
+    """
+    regressions = []
+    for scale, endpoints in report['results'].items():
+        for name, result in endpoints.items():
+            base = baseline.get('results', {}).get(scale, {}).get(name)
+            if not base:
+                continue
+            for metric in METRICS:
+                if result[metric] > base[metric] * (1 + threshold) and result[metric] - base[metric] > NOISE[metric]:
+                    regressions.append(f'{scale}/{name}: {metric} {base[metric]} -> {result[metric]}')
+    return regressions
+
+
+class Command(BaseCommand):
+    help = ('Замер задержки (p50/p95), числа SQL-запросов и пиковой памяти всех адресов API '
+            'на синтетическом каталоге в тестовой базе')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='1000,10000,100000', help='число позиций каталога через запятую')
+        parser.add_argument('--repeat', type=int, default=20, help='число замеров задержки на адрес')
+        parser.add_argument('--output', default='bench_endpoints.json', help='файл отчета')
+        parser.add_argument('--baseline', help='отчет, с которым сравнивать результаты')
+        parser.add_argument('--threshold', type=float, default=0.2, help='допустимый рост метрики, доля')
+
+    def handle(self, *args, **options):
+        scales = [int(scale) for scale in options['scales'].split(',')]
+        self.check_coverage()
+
+        setup_test_environment()
+        # задачи, которые ставят адреса, выполняются в процессе замера
+        celery_app.conf.task_always_eager = True
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            # partner/update загружает прайс замера из локального файла
+            with override_settings(FEED_ALLOW_LOCAL_FILES=True):
+                results = {str(scale): self.run_scale(scale, options['repeat']) for scale in scales}
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {'created': datetime.now().isoformat(timespec='seconds'), 'database': connection.vendor,
+                  'repeat': options['repeat'], 'results': results}
+        with open(options['output'], 'w') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        self.stdout.write(f'Report: {options["output"]}')
+
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                regressions = compare(report, json.load(file), options['threshold'])
+            if regressions:
+                raise CommandError('Regressions:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions'))
+
+    def check_coverage(self):
+        covered = {url_name for _, url_name, *_ in ENDPOINTS}
+        missing = {pattern.name for pattern in get_resolver().url_patterns if getattr(pattern, 'name', None)} - covered
+        if missing:
+            self.stderr.write(f'Endpoints without benchmark: {", ".join(sorted(missing))}')
+
+    def seed(self, scale):
+        call_command('flush', interactive=False, verbosity=0)
+        shop_user = User.objects.create_user(email='shop@bench.local', password=PASSWORD, type='shop', is_active=True)
+        buyer = User.objects.create_user(email='buyer@bench.local', password=PASSWORD, is_active=True)
+        shop = Shop.objects.create(name='Synthetic', user=shop_user)
+        import_price_list(generate_price_list(goods=scale), shop=shop)
+
+        # прайс по ссылке совпадает с загруженным, поэтому partner/update доходит до сравнения хэша
+        with tempfile.NamedTemporaryFile('w', suffix='.yaml', delete=False) as file:
+            write_price_list(file, goods=scale)
+        shop.url = file.name
+        shop.save(update_fields=['url'])
+        job = ImportJob.objects.create(user=shop_user, shop=shop, mode='incremental')
+
+        contact = Contact.objects.create(user=buyer, phone='+70000000000', city='Город', street='Улица', house='1')
+        info_ids = list(ProductInfo.objects.order_by('id').values_list('id', flat=True)[:50])
+        for number, status in enumerate(['basket'] + ['new'] * 4):
+            order = Order.objects.create(user=buyer, status=status, contact=None if status == 'basket' else contact)
+            OrderItem.objects.bulk_create([OrderItem(order=order, product_info_id=info_id, shop=shop, quantity=1)
+                                           for info_id in info_ids[number * 10:(number + 1) * 10]])
+        return {'buyer': Token.objects.create(user=buyer).key, 'shop': Token.objects.create(user=shop_user).key,
+                'job_id': job.id, 'path': file.name}
+
+    def run_scale(self, scale, repeat):
+        self.stdout.write(f'Seeding {scale} offers')
+        context = self.seed(scale)
+        try:
+            results = {}
+            for name, url_name, url_kwargs, query, method, data, user in ENDPOINTS:
+                url = reverse(url_name, kwargs={key: context[value] for key, value in url_kwargs.items()}) \
+                    if url_name else '/admin/'
+                if query:
+                    url = f'{url}?{urlencode(query)}'
+                client = Client(HTTP_AUTHORIZATION=f'Token {context[user]}') if user else Client()
+                results[name] = self.measure(client, method, url, data, repeat)
+                result = results[name]
+                self.stdout.write(f'{scale:>7} {name:<24} {result["status"]} p50 {result["p50_ms"]}ms '
+                                  f'p95 {result["p95_ms"]}ms queries {result["queries"]} '
+                                  f'memory {result["peak_memory_kb"]}KB')
+            return results
+        finally:
+            os.unlink(context['path'])
+
+    def request(self, client, method, url, data):
+        # ответы каталога и счетчики ограничения запросов хранятся в кэше, замеряется запрос без кэша
+        get_cache().clear()
+        caches['default'].clear()
+        response = getattr(client, method)(url, data, content_type='application/json') if data is not None \
+            else getattr(client, method)(url)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        return response
+
+    def measure(self, client, method, url, data, repeat):
+        response = self.request(client, method, url, data)
+
+        # журнал запросов ограничен по длине, после наполнения базы его счетчик не растет
+        reset_queries()
+        tracemalloc.start()
+        with CaptureQueriesContext(connection) as queries:
+            self.request(client, method, url, data)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            self.request(client, method, url, data)
+            timings.append((time.perf_counter() - started) * 1000)
+        return {'method': method.upper(), 'url': url, 'status': response.status_code,
+                'p50_ms': round(percentile(timings, 50), 2), 'p95_ms': round(percentile(timings, 95), 2),
+                'queries': len(queries), 'peak_memory_kb': round(peak / 1024, 1)}
@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from backend.models import Shop
+from backend.synthetic import write_price_list
+from backend.tasks import import_shop
+
+
+class Command(BaseCommand):
+    help = ('Замер импорта синтетического прайса в тестовую базу: первый импорт, повторный без изменений '
+            'и повторный с небольшой долей измененных товаров')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--goods', type=int, default=10000, help='число товаров в прайсе')
+        parser.add_argument('--parameters', type=int, default=4, help='число параметров у товара')
+        parser.add_argument('--categories', type=int, default=10, help='число категорий')
+        parser.add_argument('--delta', type=float, default=0.01, help='доля измененных товаров')
+        parser.add_argument('--mode', default=None, help="режим импорта: 'full' или 'incremental'")
+        parser.add_argument('--backend', default=None, help="запись при импорте: 'orm' или 'copy'")
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--memory', action=argparse.BooleanOptionalAction, default=True,
+                            help='отдельный проход с замером пиковой памяти каждого этапа по tracemalloc')
+        parser.add_argument('--output', default='bench_import.json', help='файл отчета')
+
+    def handle(self, *args, **options):
+        price_list = {key: options[key] for key in ('goods', 'parameters', 'categories')}
+        paths = {}
+        try:
+            for name, changed in (('base', 0.0), ('delta', options['delta'])):
+                with tempfile.NamedTemporaryFile('w', suffix='.yaml', delete=False) as file:
+                    write_price_list(file, changed=changed, **price_list)
+                paths[name] = file.name
+            self.stdout.write(f'Price list: {os.path.getsize(paths["base"]) / 1024 / 1024:.1f}MB')
+
+            overrides = {'IMPORT_BACKEND': options['backend'] or settings.IMPORT_BACKEND,
+                         'IMPORT_BATCH_SIZE': options['batch_size'] or settings.IMPORT_BATCH_SIZE}
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                # прайс замера лежит в локальном файле
+                with override_settings(FEED_ALLOW_LOCAL_FILES=True, **overrides):
+                    results = self.run_phases(paths, options['mode'], False)
+                    # tracemalloc в разы замедляет импорт, поэтому память замеряется отдельным проходом
+                    if options['memory']:
+                        for phase, result in self.run_phases(paths, options['mode'], True).items():
+                            results[phase]['peak_memory_kb'] = result['peak_memory_kb']
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+        finally:
+            for path in paths.values():
+                os.unlink(path)
+
+        report = {'created': datetime.now().isoformat(timespec='seconds'), 'database': connection.vendor,
+                  'mode': options['mode'] or settings.IMPORT_MODE, 'delta': options['delta'],
+                  'price_list': price_list, 'results': results, **overrides}
+        for phase, result in results.items():
+            memory = '' if result['peak_memory_kb'] is None else f' peak memory {result["peak_memory_kb"]}KB'
+            self.stdout.write(f'{phase:<10} {result["seconds"]}s {result["rows_per_sec"]} rows/sec '
+                              f'queries {result["queries"]}{memory} {result["stats"]}')
+        with open(options['output'], 'w') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        self.stdout.write(f'Report: {options["output"]}')
+
+    def run_phases(self, paths, mode, memory):
+        """
+        Первый импорт в пустую базу, повторный без изменений и повторный с измененными товарами
+        """
+        call_command('flush', interactive=False, verbosity=0)
+        shop = Shop.objects.create(name='Synthetic')
+        return {phase: self.measure(shop, paths[path], mode, memory)
+                for phase, path in (('cold', 'base'), ('unchanged', 'base'), ('delta', 'delta'))}
+
+    def measure(self, shop, path, mode, memory):
+        shop.url = path
+        queries = 0
+
+        def count_queries(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        # пик памяти считается для каждого этапа отдельно, а не с запуска процесса
+        if memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        with connection.execute_wrapper(count_queries):
+            stats = import_shop(shop, mode, True, None)
+        seconds = time.perf_counter() - started
+        peak = None
+        if memory:
+            peak = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+            tracemalloc.stop()
+        return {'seconds': round(seconds, 3), 'rows_per_sec': round(stats['rows'] / seconds, 1),
+                'queries': queries, 'peak_memory_kb': peak, 'stats': stats}
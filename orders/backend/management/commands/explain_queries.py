@@ -0,0 +1,99 @@
+import json
+import os
+from urllib.parse import urlencode
+
+from django.core.management.base import CommandError
+from django.db import connection, reset_queries, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, \
+    teardown_test_environment
+from django.urls import reverse
+
+from backend.management.commands.bench_endpoints import ENDPOINTS, Command as BenchCommand
+from orders.celery import celery_app
+
+
+def iter_plan(node):
+    yield node
+    for child in node.get('Plans', ()):
+        yield from iter_plan(child)
+
+
+class Command(BenchCommand):
+    help = ('EXPLAIN ANALYZE всех SELECT-запросов адресов API на синтетическом каталоге в тестовой базе '
+            'с поиском последовательного чтения больших таблиц')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, default=10000, help='число позиций каталога')
+        parser.add_argument('--min-rows', type=int, default=1000,
+                            help='последовательное чтение таблиц меньшего размера не считается проблемой')
+        parser.add_argument('--output', help='файл отчета с планами запросов')
+        parser.add_argument('--fail', action='store_true', help='завершиться с ошибкой, если найдены Seq Scan')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('EXPLAIN ANALYZE plans are collected on PostgreSQL only')
+
+        setup_test_environment()
+        celery_app.conf.task_always_eager = True
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.stdout.write(f'Seeding {options["scale"]} offers')
+            context = self.seed(options['scale'])
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE')
+                with override_settings(FEED_ALLOW_LOCAL_FILES=True):
+                    results = {name: self.explain_endpoint(context, name, *endpoint, options['min_rows'])
+                               for name, *endpoint in ENDPOINTS}
+            finally:
+                os.unlink(context['path'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Report: {options["output"]}')
+
+        flagged = [(name, scan) for name, queries in results.items()
+                   for query in queries for scan in query['seq_scans']]
+        for name, scan in flagged:
+            self.stdout.write(self.style.WARNING(f'{name}: Seq Scan on {scan}'))
+        if flagged and options['fail']:
+            raise CommandError(f'Sequential scans found: {len(flagged)}')
+        if not flagged:
+            self.stdout.write(self.style.SUCCESS('No sequential scans on large tables'))
+
+    def table_sizes(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT relname, reltuples FROM pg_class WHERE relkind = 'r'")
+            return dict(cursor.fetchall())
+
+    def explain_endpoint(self, context, name, url_name, url_kwargs, query, method, data, user, min_rows):
+        url = reverse(url_name, kwargs={key: context[value] for key, value in url_kwargs.items()}) \
+            if url_name else '/admin/'
+        if query:
+            url = f'{url}?{urlencode(query)}'
+        client = Client(HTTP_AUTHORIZATION=f'Token {context[user]}') if user else Client()
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            self.request(client, method, url, data)
+
+        sizes = self.table_sizes()
+        results = []
+        # INSERT, UPDATE и DELETE не повторяются, EXPLAIN ANALYZE выполняет запрос
+        for sql in {query['sql']: None for query in queries.captured_queries
+                    if query['sql'].lstrip().upper().startswith(('SELECT', 'WITH'))}:
+            # WITH может изменять данные (корзина - WITH ... INSERT), поэтому изменения откатываются
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN (ANALYZE, FORMAT JSON) {sql}')
+                plan = cursor.fetchone()[0][0]
+                transaction.set_rollback(True)
+            seq_scans = sorted({node['Relation Name'] for node in iter_plan(plan['Plan'])
+                                if node['Node Type'] == 'Seq Scan' and sizes.get(node['Relation Name'], 0) >= min_rows})
+            results.append({'sql': sql, 'execution_ms': plan['Execution Time'], 'seq_scans': seq_scans})
+        self.stdout.write(f'{name:<24} queries {len(queries)} explained {len(results)} '
+                          f'seq scans {sum(len(result["seq_scans"]) for result in results)}')
+        return results
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from backend.cache import bump_catalog_version
+from backend.catalog import rebuild_catalog
+from backend.models import CatalogEntry
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает витрину каталога товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        rebuild_catalog(options['chunk_size'])
+        bump_catalog_version()
+        self.stdout.write(f'Catalog entries: {CatalogEntry.objects.count()}')
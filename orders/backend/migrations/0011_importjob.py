@@ -0,0 +1,38 @@
+# Generated by Django 4.0.4 on 2026-10-18 18:09
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0010_alter_user_is_active'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.CharField(blank=True, max_length=50, verbose_name='ИД задачи')),
+                ('mode', models.CharField(blank=True, max_length=20, verbose_name='режим импорта')),
+                ('state', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('success', 'Завершен'), ('failed', 'Ошибка')], default='pending', max_length=20, verbose_name='статус')),
+                ('rows_parsed', models.PositiveIntegerField(default=0, verbose_name='прочитано строк')),
+                ('rows_written', models.PositiveIntegerField(default=0, verbose_name='записано строк')),
+                ('stats', models.JSONField(blank=True, default=dict, verbose_name='статистика')),
+                ('error', models.TextField(blank=True, verbose_name='ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='создан')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='начат')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='завершен')),
+                ('shop', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to='backend.shop', verbose_name='Магазин')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Задача импорта',
+                'verbose_name_plural': 'Список задач импорта',
+                'ordering': ('-created_at',),
+            },
+        ),
+    ]
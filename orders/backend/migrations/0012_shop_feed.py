@@ -0,0 +1,38 @@
+# Generated by Django 4.0.4 on 2026-10-18 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0011_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='feed_etag',
+            field=models.CharField(blank=True, max_length=200, verbose_name='ETag последнего прайса'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='feed_hash',
+            field=models.CharField(blank=True, max_length=64, verbose_name='sha256 последнего прайса'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='feed_last_modified',
+            field=models.CharField(blank=True, max_length=50, verbose_name='Last-Modified последнего прайса'),
+        ),
+        migrations.AlterField(
+            model_name='importjob',
+            name='state',
+            field=models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('success', 'Завершен'), ('failed', 'Ошибка'), ('skipped', 'Пропущен, прайс не изменился')], default='pending', max_length=20, verbose_name='статус'),
+        ),
+        migrations.AlterField(
+            model_name='shop',
+            name='url',
+            field=models.CharField(blank=True, max_length=200, null=True, verbose_name='ссылка для обновления прайса'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.4 on 2026-10-18 18:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0012_shop_feed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='import_lock_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='импорт заблокирован до'),
+        ),
+        migrations.AlterField(
+            model_name='importjob',
+            name='state',
+            field=models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('success', 'Завершен'), ('failed', 'Ошибка'), ('skipped', 'Пропущен')], default='pending', max_length=20, verbose_name='статус'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.0.4 on 2026-10-18 18:17
+
+from django.conf import settings
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def fill_search_vectors(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('''
+        UPDATE backend_productinfo AS info SET search_vector =
+            setweight(to_tsvector(%(config)s::regconfig, product.name), 'A') ||
+            setweight(to_tsvector(%(config)s::regconfig, translate(info.model, '/_-', '   ')), 'B') ||
+            setweight(to_tsvector(%(config)s::regconfig, coalesce((
+                SELECT string_agg(param.value, ' ') FROM backend_productparameter AS param
+                WHERE param.product_info_id = info.id), '')), 'C')
+        FROM backend_product AS product
+        WHERE product.id = info.product_id
+    ''', {'config': settings.SEARCH_CONFIG})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0013_shop_import_lock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productinfo',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True, verbose_name='поисковый вектор'),
+        ),
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='product_info_search_idx'),
+        ),
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+    ]
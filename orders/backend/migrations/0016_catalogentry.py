@@ -0,0 +1,113 @@
+# Generated by Django 4.0.4 on 2026-10-18 18:23
+
+from collections import defaultdict
+
+from django.conf import settings
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+import django.db.models.deletion
+
+CHUNK_SIZE = 1000
+
+
+def fill_catalog(apps, schema_editor):
+    ProductInfo = apps.get_model('backend', 'ProductInfo')
+    ProductParameter = apps.get_model('backend', 'ProductParameter')
+    CatalogEntry = apps.get_model('backend', 'CatalogEntry')
+    last_id = 0
+    while True:
+        rows = list(ProductInfo.objects.filter(id__gt=last_id).order_by('id').values_list(
+            'id', 'shop_id', 'shop__name', 'shop__state', 'product__category_id', 'product__category__name',
+            'product__name', 'external_id', 'model', 'quantity', 'price', 'price_rrc')[:CHUNK_SIZE])
+        if not rows:
+            break
+        parameters = defaultdict(list)
+        for info_id, name, value in ProductParameter.objects.filter(
+                product_info_id__in=[row[0] for row in rows]).order_by('id').values_list(
+                'product_info_id', 'parameter__name', 'value'):
+            parameters[info_id].append({'parameter': name, 'value': value})
+        CatalogEntry.objects.bulk_create([
+            CatalogEntry(product_info_id=info_id, shop_id=shop_id, shop_name=shop_name, shop_state=shop_state,
+                         category_id=category_id, category_name=category_name, product_name=product_name,
+                         external_id=external_id, model=model, quantity=quantity, price=price,
+                         price_rrc=price_rrc, parameters=parameters[info_id])
+            for info_id, shop_id, shop_name, shop_state, category_id, category_name, product_name, external_id,
+            model, quantity, price, price_rrc in rows])
+        last_id = rows[-1][0]
+
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('''
+        UPDATE backend_catalogentry SET search_vector =
+            setweight(to_tsvector(%(config)s::regconfig, product_name), 'A') ||
+            setweight(to_tsvector(%(config)s::regconfig, translate(model, '/_-', '   ')), 'B') ||
+            setweight(to_tsvector(%(config)s::regconfig, coalesce((
+                SELECT string_agg(param->>'value', ' ') FROM jsonb_array_elements(parameters) AS param), '')), 'C')
+    ''', {'config': settings.SEARCH_CONFIG})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0015_catalog_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogEntry',
+            fields=[
+                ('product_info', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='catalog_entry', serialize=False, to='backend.productinfo', verbose_name='Информация о продукте')),
+                ('shop_name', models.CharField(max_length=50, verbose_name='название магазина')),
+                ('shop_state', models.BooleanField(verbose_name='статус получения заказов')),
+                ('category_name', models.CharField(max_length=50, verbose_name='название категории')),
+                ('product_name', models.CharField(max_length=50, verbose_name='название')),
+                ('external_id', models.PositiveIntegerField(verbose_name='Внешний ИД')),
+                ('model', models.CharField(max_length=50, verbose_name='модель')),
+                ('quantity', models.PositiveIntegerField(verbose_name='количество')),
+                ('price', models.PositiveIntegerField(verbose_name='цена')),
+                ('price_rrc', models.PositiveIntegerField(verbose_name='Рекомендуемая розничная цена')),
+                ('parameters', models.JSONField(default=list, verbose_name='параметры')),
+                ('search_vector', django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True, verbose_name='поисковый вектор')),
+            ],
+            options={
+                'verbose_name': 'Позиция каталога',
+                'verbose_name_plural': 'Витрина каталога',
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='productinfo',
+            name='product_info_search_idx',
+        ),
+        migrations.RemoveField(
+            model_name='productinfo',
+            name='search_vector',
+        ),
+        migrations.AddField(
+            model_name='catalogentry',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='catalog_entries', to='backend.category', verbose_name='Категория'),
+        ),
+        migrations.AddField(
+            model_name='catalogentry',
+            name='shop',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='catalog_entries', to='backend.shop', verbose_name='магазин'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogentry',
+            index=models.Index(fields=['shop_state', 'product_info'], name='catalog_entry_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogentry',
+            index=models.Index(fields=['category', 'price'], name='catalog_entry_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogentry',
+            index=models.Index(fields=['price'], name='catalog_entry_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogentry',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='catalog_entry_search_idx'),
+        ),
+        migrations.RunPython(fill_catalog, migrations.RunPython.noop),
+    ]
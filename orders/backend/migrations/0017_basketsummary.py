@@ -0,0 +1,30 @@
+# Generated by Django 4.0.4 on 2026-10-18 18:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0016_catalogentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BasketSummary',
+            fields=[
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='backend.order', verbose_name='корзина')),
+                ('lines', models.PositiveIntegerField(default=0, verbose_name='число позиций')),
+                ('quantity', models.PositiveIntegerField(default=0, verbose_name='количество товаров')),
+                ('total_sum', models.PositiveIntegerField(default=0, verbose_name='сумма')),
+                ('shops', models.JSONField(default=dict, verbose_name='итоги по магазинам')),
+                ('is_stale', models.BooleanField(default=False, verbose_name='требует пересчета')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='обновлено')),
+            ],
+            options={
+                'verbose_name': 'Итоги корзины',
+                'verbose_name_plural': 'Список итогов корзин',
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.0.4 on 2026-10-18 18:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_shop(apps, schema_editor):
+    OrderItem = apps.get_model('backend', 'OrderItem')
+    ProductInfo = apps.get_model('backend', 'ProductInfo')
+    OrderItem.objects.filter(shop__isnull=True).update(shop_id=models.Subquery(
+        ProductInfo.objects.filter(id=models.OuterRef('product_info_id')).values('shop_id')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0017_basketsummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='shop',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ordered_items', to='backend.shop', verbose_name='магазин'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['shop', 'order'], name='order_item_shop_order_idx'),
+        ),
+        migrations.RunPython(fill_shop, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.0.4 on 2026-10-18 18:40
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_totals(apps, schema_editor):
+    # цены размещенных раньше заказов не сохранялись, берется текущая цена позиции
+    Order = apps.get_model('backend', 'Order')
+    OrderItem = apps.get_model('backend', 'OrderItem')
+    ProductInfo = apps.get_model('backend', 'ProductInfo')
+    OrderItem.objects.filter(price__isnull=True).exclude(order__status='basket').update(price=models.Subquery(
+        ProductInfo.objects.filter(id=models.OuterRef('product_info_id')).values('price')[:1]))
+    totals = OrderItem.objects.filter(order_id=models.OuterRef('pk')).values('order_id').annotate(
+        total=models.Sum(models.F('quantity') * models.F('price'))).values('total')
+    Order.objects.exclude(status='basket').update(total_sum=Coalesce(models.Subquery(totals), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0018_orderitem_shop'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total_sum',
+            field=models.PositiveIntegerField(default=0, verbose_name='сумма заказа'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='price',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='цена'),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.0.4 on 2026-10-18 18:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0019_order_total_sum'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'status', 'dt'], name='order_user_status_dt_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.0.4 on 2026-10-18 18:43
+
+from django.db import migrations, models
+
+
+def merge_baskets(apps, schema_editor):
+    """
+    Оставляет у пользователя одну корзину: позиции остальных корзин переносятся в самую раннюю
+    """
+    Order = apps.get_model('backend', 'Order')
+    OrderItem = apps.get_model('backend', 'OrderItem')
+    BasketSummary = apps.get_model('backend', 'BasketSummary')
+    duplicates = Order.objects.filter(status='basket').values('user_id').annotate(
+        baskets=models.Count('id'), first_id=models.Min('id')).filter(baskets__gt=1).values_list('user_id', 'first_id')
+    for user_id, basket_id in duplicates:
+        extra = Order.objects.filter(user_id=user_id, status='basket').exclude(id=basket_id)
+        in_basket = set(OrderItem.objects.filter(order_id=basket_id).values_list('product_info_id', flat=True))
+        for order_item in OrderItem.objects.filter(order__in=extra).order_by('id'):
+            if order_item.product_info_id not in in_basket:
+                in_basket.add(order_item.product_info_id)
+                OrderItem.objects.filter(id=order_item.id).update(order_id=basket_id)
+        BasketSummary.objects.filter(order_id=basket_id).update(is_stale=True)
+        extra.delete()
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0020_order_user_status_dt_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_baskets, migrations.RunPython.noop),
+    ]
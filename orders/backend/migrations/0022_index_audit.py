@@ -0,0 +1,25 @@
+# Generated by Django 4.0.4 on 2026-10-18 18:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0021_merge_baskets'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=models.Index(fields=['shop', 'external_id'], name='product_info_shop_external_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shop',
+            index=models.Index(condition=models.Q(('state', True)), fields=['id'], name='shop_active_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'basket')), fields=('user',), name='unique_user_basket'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.0.4 on 2026-10-18 19:04
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0022_index_audit'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='productinfo',
+            name='product_info_price_idx',
+        ),
+    ]
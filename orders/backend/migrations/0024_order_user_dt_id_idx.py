@@ -0,0 +1,17 @@
+# Generated by Django 4.0.4 on 2026-10-18 19:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0023_remove_productinfo_price_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'dt', 'id'], name='order_user_dt_id_idx'),
+        ),
+    ]
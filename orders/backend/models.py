@@ -1,8 +1,11 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
-from django.db.models import CASCADE
+from django.db.models import CASCADE, Q
+from django.utils import timezone
 from django_rest_passwordreset.tokens import get_token_generator
 
 STATE_CHOICES = (
@@ -15,6 +18,14 @@ STATE_CHOICES = (
     ('canceled', 'Отменен'),
 )
 
+IMPORT_JOB_STATES = (
+    ('pending', 'В очереди'),
+    ('running', 'Выполняется'),
+    ('success', 'Завершен'),
+    ('failed', 'Ошибка'),
+    ('skipped', 'Пропущен'),
+)
+
 TYPE_OF_USER = (
     ('shop', 'Магазин'),
     ('buyer', 'Покупатель')
@@ -96,7 +107,11 @@ class User(AbstractUser):
 
 
 class Shop(models.Model):
-    url = models.CharField(max_length=50, null=True, blank=True, verbose_name='ссылка для обновления прайса')
+    url = models.CharField(max_length=200, null=True, blank=True, verbose_name='ссылка для обновления прайса')
+    feed_etag = models.CharField(max_length=200, blank=True, verbose_name='ETag последнего прайса')
+    feed_last_modified = models.CharField(max_length=50, blank=True, verbose_name='Last-Modified последнего прайса')
+    feed_hash = models.CharField(max_length=64, blank=True, verbose_name='sha256 последнего прайса')
+    import_lock_until = models.DateTimeField(null=True, blank=True, verbose_name='импорт заблокирован до')
     name = models.CharField(max_length=50, verbose_name='название')
     state = models.BooleanField(default=True, verbose_name='статус получения заказов')
     user = models.OneToOneField(User, verbose_name='Пользователь',
@@ -106,6 +121,10 @@ class Shop(models.Model):
     class Meta:
         verbose_name = 'Магазин'
         verbose_name_plural = "Список магазинов"
+        indexes = [
+            # список магазинов и проверки позиций читают только принимающие заказы магазины
+            models.Index(fields=['id'], condition=Q(state=True), name='shop_active_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -150,11 +169,51 @@ class ProductInfo(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['product', 'shop', 'external_id'], name='unique_product_info'),
         ]
+        indexes = [
+            # импорт сопоставляет позиции по (shop, external_id)
+            models.Index(fields=['shop', 'external_id'], name='product_info_shop_external_idx'),
+        ]
 
     def __str__(self):
         return f'{self.product}'
 
 
+class CatalogEntry(models.Model):
+    """
+    Денормализованная витрина каталога: одна строка на позицию с названиями магазина,
+    категории и товара и готовым списком параметров. Обновляется импортом и сменой статуса магазина
+    """
+    product_info = models.OneToOneField(ProductInfo, on_delete=CASCADE, primary_key=True,
+                                        verbose_name='Информация о продукте', related_name='catalog_entry')
+    shop = models.ForeignKey(Shop, on_delete=CASCADE, verbose_name='магазин', related_name='catalog_entries')
+    shop_name = models.CharField(max_length=50, verbose_name='название магазина')
+    shop_state = models.BooleanField(verbose_name='статус получения заказов')
+    category = models.ForeignKey(Category, on_delete=CASCADE, verbose_name='Категория',
+                                 related_name='catalog_entries')
+    category_name = models.CharField(max_length=50, verbose_name='название категории')
+    product_name = models.CharField(max_length=50, verbose_name='название')
+    external_id = models.PositiveIntegerField(verbose_name='Внешний ИД')
+    model = models.CharField(max_length=50, verbose_name='модель')
+    quantity = models.PositiveIntegerField(verbose_name='количество')
+    price = models.PositiveIntegerField(verbose_name='цена')
+    price_rrc = models.PositiveIntegerField(verbose_name='Рекомендуемая розничная цена')
+    parameters = models.JSONField(verbose_name='параметры', default=list)
+    search_vector = SearchVectorField(verbose_name='поисковый вектор', null=True, blank=True, editable=False)
+
+    class Meta:
+        verbose_name = 'Позиция каталога'
+        verbose_name_plural = "Витрина каталога"
+        indexes = [
+            models.Index(fields=['shop_state', 'product_info'], name='catalog_entry_state_idx'),
+            models.Index(fields=['category', 'price'], name='catalog_entry_category_idx'),
+            models.Index(fields=['price'], name='catalog_entry_price_idx'),
+            GinIndex(fields=['search_vector'], name='catalog_entry_search_idx'),
+        ]
+
+    def __str__(self):
+        return self.product_name
+
+
 class Contact(models.Model):
     user = models.ForeignKey(User, on_delete=CASCADE, verbose_name='Пользователь', related_name='contacts', blank=True)
     phone = models.CharField(max_length=20, verbose_name='Телефон',)
@@ -179,10 +238,22 @@ class Order(models.Model):
     dt = models.DateTimeField(auto_now_add=True, verbose_name='время заказа',)
     status = models.CharField(max_length=20, choices=STATE_CHOICES, verbose_name='статус заказа')
     contact = models.ForeignKey(Contact, on_delete=CASCADE, verbose_name='контакты', blank=True, null=True)
+    # сумма заказа по ценам на момент размещения, у корзины не заполняется
+    total_sum = models.PositiveIntegerField(default=0, verbose_name='сумма заказа')
 
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = "Список заказов"
+        constraints = [
+            # одна корзина на пользователя
+            models.UniqueConstraint(fields=['user'], condition=Q(status='basket'), name='unique_user_basket'),
+        ]
+        indexes = [
+            # заказы пользователя по статусу (корзина, фильтр status) и по времени
+            models.Index(fields=['user', 'status', 'dt'], name='order_user_status_dt_idx'),
+            # история заказов пользователя по курсору (-dt, -id)
+            models.Index(fields=['user', 'dt', 'id'], name='order_user_dt_id_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user}, {self.dt}'
@@ -193,7 +264,12 @@ class OrderItem(models.Model):
                               related_name='ordered_items')
     product_info = models.ForeignKey(ProductInfo, on_delete=CASCADE, verbose_name='информация о продукте', blank=True,
                                      related_name='ordered_items')
+    # магазин позиции, копия product_info.shop для выборки заказов поставщика
+    shop = models.ForeignKey(Shop, on_delete=CASCADE, verbose_name='магазин', blank=True, null=True,
+                             related_name='ordered_items')
     quantity = models.PositiveIntegerField(verbose_name='количество', blank=True)
+    # цена за единицу на момент размещения заказа, у позиций корзины пустая
+    price = models.PositiveIntegerField(verbose_name='цена', blank=True, null=True)
 
     class Meta:
         verbose_name = 'Заказанная позиция'
@@ -201,6 +277,52 @@ class OrderItem(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['order_id', 'product_info'], name='unique_order_item'),
         ]
+        indexes = [
+            models.Index(fields=['shop', 'order'], name='order_item_shop_order_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.shop_id is None and self.product_info_id:
+            self.shop_id = ProductInfo.objects.values_list('shop_id', flat=True).get(id=self.product_info_id)
+        super().save(*args, **kwargs)
+
+
+class BasketSummary(models.Model):
+    order = models.OneToOneField(Order, on_delete=CASCADE, primary_key=True, verbose_name='корзина',
+                                 related_name='summary')
+    lines = models.PositiveIntegerField(default=0, verbose_name='число позиций')
+    quantity = models.PositiveIntegerField(default=0, verbose_name='количество товаров')
+    total_sum = models.PositiveIntegerField(default=0, verbose_name='сумма')
+    shops = models.JSONField(default=dict, verbose_name='итоги по магазинам')
+    is_stale = models.BooleanField(default=False, verbose_name='требует пересчета')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='обновлено')
+
+    class Meta:
+        verbose_name = 'Итоги корзины'
+        verbose_name_plural = "Список итогов корзин"
+
+    def __str__(self):
+        return f'{self.order_id}: {self.lines} / {self.total_sum}'
+
+    def apply(self, changes):
+        """
+        Прибавляет изменения {ИД магазина: (название, позиций, количество, сумма)}
+        """
+        for shop_id, (name, lines, quantity, total_sum) in changes.items():
+            shop = self.shops.setdefault(str(shop_id), {'name': name, 'lines': 0, 'quantity': 0, 'sum': 0})
+            shop['lines'] += lines
+            shop['quantity'] += quantity
+            shop['sum'] += total_sum
+            if shop['lines'] <= 0:
+                del self.shops[str(shop_id)]
+            self.lines += lines
+            self.quantity += quantity
+            self.total_sum += total_sum
+
+    def as_dict(self):
+        return {'id': self.order_id, 'lines': self.lines, 'quantity': self.quantity, 'total_sum': self.total_sum,
+                'shops': [dict(shop, id=int(shop_id)) for shop_id, shop in
+                          sorted(self.shops.items(), key=lambda item: int(item[0]))]}
 
 
 class Parameter(models.Model):
@@ -229,6 +351,60 @@ class ProductParameter(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['product_info', 'parameter'], name='unique_product_parameter'),
         ]
+        indexes = [
+            models.Index(fields=['parameter', 'value'], name='product_parameter_value_idx'),
+        ]
+
+
+class ImportJob(models.Model):
+    user = models.ForeignKey(User, on_delete=CASCADE, verbose_name='Пользователь', related_name='import_jobs',
+                             blank=True, null=True)
+    shop = models.ForeignKey(Shop, on_delete=CASCADE, verbose_name='Магазин', related_name='import_jobs',
+                             blank=True, null=True)
+    task_id = models.CharField(max_length=50, verbose_name='ИД задачи', blank=True)
+    mode = models.CharField(max_length=20, verbose_name='режим импорта', blank=True)
+    state = models.CharField(max_length=20, choices=IMPORT_JOB_STATES, verbose_name='статус', default='pending')
+    rows_parsed = models.PositiveIntegerField(verbose_name='прочитано строк', default=0)
+    rows_written = models.PositiveIntegerField(verbose_name='записано строк', default=0)
+    stats = models.JSONField(verbose_name='статистика', default=dict, blank=True)
+    error = models.TextField(verbose_name='ошибка', blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='создан')
+    started_at = models.DateTimeField(verbose_name='начат', blank=True, null=True)
+    finished_at = models.DateTimeField(verbose_name='завершен', blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Задача импорта'
+        verbose_name_plural = "Список задач импорта"
+        ordering = ('-created_at',)
+
+    def __str__(self):
+        return f'{self.id} {self.state}'
+
+    def mark_running(self, task_id):
+        self.state = 'running'
+        self.task_id = task_id or ''
+        self.started_at = timezone.now()
+        self.save(update_fields=['state', 'task_id', 'started_at'])
+
+    def mark_finished(self, stats):
+        self.state = 'success'
+        self.stats = stats
+        self.rows_parsed = stats['rows']
+        self.rows_written = stats['created'] + stats['updated']
+        self.finished_at = timezone.now()
+        self.save(update_fields=['state', 'stats', 'rows_parsed', 'rows_written', 'finished_at'])
+
+    def mark_skipped(self, stats):
+        self.state = 'skipped'
+        self.stats = stats
+        self.finished_at = timezone.now()
+        self.save(update_fields=['state', 'stats', 'finished_at'])
+
+    def mark_failed(self, error):
+        self.state = 'failed'
+        self.error = str(error)
+        self.finished_at = timezone.now()
+        self.save(update_fields=['state', 'error', 'finished_at'])
 
 
 class ConfirmEmailToken(models.Model):
@@ -0,0 +1,85 @@
+"""
+Выборки и фильтры заказов
+"""
+from datetime import datetime, time
+
+from django.conf import settings
+from django.db.models import Exists, F, OuterRef, Prefetch, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from backend.models import STATE_CHOICES, Order, OrderItem
+
+ORDER_STATES = {state for state, _ in STATE_CHOICES} - {'basket'}
+
+
+class OrderFilterError(ValueError):
+    """
+    Неверное значение фильтра заказов
+    """
+
+
+def parse_dt(name, value):
+    try:
+        dt = parse_datetime(value)
+        date = None if dt else parse_date(value)
+    except ValueError:
+        dt = date = None
+    if dt is None:
+        if date is None:
+            raise OrderFilterError(f'{name} must be an ISO date or datetime')
+        dt = datetime.combine(date, time())
+    if settings.USE_TZ and timezone.is_naive(dt):
+        dt = timezone.make_aware(dt)
+    return dt
+
+
+def filter_orders(queryset, params):
+    """
+    Фильтрует заказы по статусу (status=new,sent) и времени заказа (dt_from, dt_to)
+    """
+    statuses = params.get('status')
+    if statuses:
+        statuses = set(statuses.split(','))
+        if not statuses <= ORDER_STATES:
+            raise OrderFilterError(f'Unknown status: {", ".join(sorted(statuses - ORDER_STATES))}')
+        queryset = queryset.filter(status__in=statuses)
+    if params.get('dt_from'):
+        queryset = queryset.filter(dt__gte=parse_dt('dt_from', params['dt_from']))
+    if params.get('dt_to'):
+        queryset = queryset.filter(dt__lt=parse_dt('dt_to', params['dt_to']))
+    return queryset
+
+
+def ordered_items_prefetch(queryset=None):
+    """
+    Позиции заказа с товаром, магазином и параметрами
+    """
+    queryset = OrderItem.objects.all() if queryset is None else queryset
+    return Prefetch('ordered_items', queryset=queryset.select_related(
+        'product_info__product__category', 'product_info__shop').prefetch_related(
+        'product_info__product_parameters__parameter').order_by('id'))
+
+
+def user_orders(user_id, summary=False):
+    """
+    Размещенные заказы покупателя, без summary - с позициями и контактом
+    """
+    queryset = Order.objects.filter(user_id=user_id).exclude(status='basket')
+    if summary:
+        return queryset.only('id', 'status', 'dt', 'total_sum')
+    return queryset.select_related('contact').prefetch_related(ordered_items_prefetch())
+
+
+def partner_orders(shop_id):
+    """
+    Заказы с позициями магазина: только его позиции и сумма по ним.
+    Заказы отбираются по индексу (shop, order) позиций
+    """
+    items = OrderItem.objects.filter(shop_id=shop_id)
+    shop_sum = items.filter(order_id=OuterRef('pk')).values('order_id').annotate(
+        total=Sum(F('quantity') * F('price'))).values('total')
+    return Order.objects.filter(Exists(items.filter(order_id=OuterRef('pk')))).exclude(
+        status='basket').select_related('contact').prefetch_related(ordered_items_prefetch(items)).annotate(
+        shop_sum=Coalesce(Subquery(shop_sum), 0))
@@ -0,0 +1,38 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+
+
+class ProductCursorPagination(CursorPagination):
+    """
+    Постраничный вывод товаров по курсору (ИД последней позиции страницы)
+    """
+    ordering = 'pk'
+    page_size = settings.PRODUCTS_PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = settings.PRODUCTS_MAX_PAGE_SIZE
+
+
+class ProductLimitOffsetPagination(LimitOffsetPagination):
+    """
+    Постраничный вывод товаров по limit/offset для совместимости
+    """
+    default_limit = settings.PRODUCTS_PAGE_SIZE
+    max_limit = settings.PRODUCTS_MAX_PAGE_SIZE
+
+
+class OrderCursorPagination(CursorPagination):
+    """
+    Постраничный вывод заказов по курсору, новые заказы первыми
+    """
+    ordering = '-id'
+    page_size = settings.ORDERS_PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = settings.ORDERS_MAX_PAGE_SIZE
+
+
+class OrderHistoryCursorPagination(OrderCursorPagination):
+    """
+    Постраничный вывод истории заказов покупателя, новые заказы первыми (индекс user, dt, id).
+    Курсор хранит позицию по dt и смещение среди заказов с тем же dt, id только задает их порядок
+    """
+    ordering = ('-dt', '-id')
@@ -0,0 +1,143 @@
+"""
+Потоковое чтение прайс-листов.
+
+Заголовок прайса (shop, categories) читается целиком, а список goods отдается генератором
+по одному товару, поэтому память не зависит от размера файла. Если часть заголовка записана
+после goods, товары читаются в память, чтобы дочитать заголовок.
+"""
+import json
+import os
+
+from yaml.events import AliasEvent, MappingEndEvent, MappingStartEvent, ScalarEvent, SequenceEndEvent, \
+    SequenceStartEvent
+from yaml.nodes import MappingNode, ScalarNode, SequenceNode
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+YAML = 'yaml'
+JSON_LINES = 'jsonl'
+
+# ключи заголовка, которые должны быть прочитаны до товаров
+HEADER_KEYS = ('shop', 'categories')
+
+FORMAT_EXTENSIONS = {
+    '.yaml': YAML,
+    '.yml': YAML,
+    '.jsonl': JSON_LINES,
+    '.ndjson': JSON_LINES,
+}
+
+
+class PriceListFormatError(ValueError):
+    """
+    Прайс-лист не соответствует ожидаемой структуре
+    """
+
+
+def detect_format(path):
+    return FORMAT_EXTENSIONS.get(os.path.splitext(str(path))[1].lower(), YAML)
+
+
+def read_price_list(stream, fmt=YAML):
+    """
+    Возвращает заголовок прайса и генератор товаров.
+
+    Генератор читает поток лениво, поэтому поток должен оставаться открытым до конца импорта.
+    """
+    if fmt == YAML:
+        return YamlPriceListReader(stream).read()
+    if fmt == JSON_LINES:
+        return read_json_lines(stream)
+    raise PriceListFormatError(f'Unknown price list format: {fmt}')
+
+
+def read_json_lines(stream):
+    """
+    JSON Lines: первая строка - заголовок {"shop": ..., "categories": [...]}, каждая следующая - товар
+    """
+    lines = (line for line in stream if line.strip())
+    first = next(lines, None)
+    if first is None:
+        raise PriceListFormatError('Price list is empty')
+    header = json.loads(first)
+    if not isinstance(header, dict) or 'categories' not in header:
+        raise PriceListFormatError("The first line must contain 'categories'")
+    return header, (json.loads(line) for line in lines)
+
+
+class YamlPriceListReader:
+    """
+    Читает YAML по событиям парсера и строит python-объекты только для отдельных товаров
+    """
+    def __init__(self, stream):
+        self.loader = SafeLoader(stream)
+
+    def read(self):
+        loader = self.loader
+        loader.get_event()
+        loader.get_event()
+        if not loader.check_event(MappingStartEvent):
+            raise PriceListFormatError('Price list must be a mapping')
+        loader.get_event()
+
+        header, goods = {}, ()
+        while not loader.check_event(MappingEndEvent):
+            key = self._construct(loader.get_event())
+            if key == 'goods':
+                if all(name in header for name in HEADER_KEYS):
+                    return header, self._stream_goods()
+                # заголовок дописан после товаров: товары держатся в памяти до конца файла
+                goods = list(self._iter_goods())
+                continue
+            header[key] = self._construct(loader.get_event())
+        loader.dispose()
+        if 'categories' not in header:
+            raise PriceListFormatError("Price list has no 'categories'")
+        return header, iter(goods)
+
+    def _stream_goods(self):
+        yield from self._iter_goods()
+        self.loader.dispose()
+
+    def _iter_goods(self):
+        loader = self.loader
+        if loader.check_event(SequenceStartEvent):
+            loader.get_event()
+            while not loader.check_event(SequenceEndEvent):
+                yield self._construct(loader.get_event())
+        # конец списка или goods: без значения
+        loader.get_event()
+
+    def _construct(self, event):
+        return self.loader.construct_document(self._compose(event))
+
+    def _compose(self, event):
+        loader = self.loader
+        if isinstance(event, AliasEvent):
+            raise PriceListFormatError('YAML aliases are not supported in price lists')
+        if isinstance(event, ScalarEvent):
+            tag = event.tag
+            if tag is None or tag == '!':
+                tag = loader.resolve(ScalarNode, event.value, event.implicit)
+            return ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+
+        if isinstance(event, SequenceStartEvent):
+            node_class, end_class = SequenceNode, SequenceEndEvent
+        elif isinstance(event, MappingStartEvent):
+            node_class, end_class = MappingNode, MappingEndEvent
+        else:
+            raise PriceListFormatError(f'Unexpected YAML event: {event}')
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(node_class, None, event.implicit)
+        node = node_class(tag, [], event.start_mark, None, flow_style=event.flow_style)
+        while not loader.check_event(end_class):
+            child = self._compose(loader.get_event())
+            if node_class is MappingNode:
+                child = (child, self._compose(loader.get_event()))
+            node.value.append(child)
+        node.end_mark = loader.get_event().end_mark
+        return node
@@ -0,0 +1,47 @@
+"""
+Полнотекстовый поиск товаров (PostgreSQL).
+
+Поисковый вектор позиции витрины каталога собирается из названия товара (вес A), модели (B)
+и значений параметров (C) и пересчитывается вместе с позицией витрины.
+"""
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery
+from django.db import connection
+
+from backend.models import CatalogEntry
+
+SEARCH_VECTOR_SQL = f'''
+    UPDATE {CatalogEntry._meta.db_table} SET search_vector =
+        setweight(to_tsvector(%(config)s::regconfig, product_name), 'A') ||
+        setweight(to_tsvector(%(config)s::regconfig, translate(model, '/_-', '   ')), 'B') ||
+        setweight(to_tsvector(%(config)s::regconfig, coalesce((
+            SELECT string_agg(param->>'value', ' ') FROM jsonb_array_elements(parameters) AS param), '')), 'C')
+    WHERE product_info_id = ANY(%(ids)s)
+'''
+
+
+def search_enabled():
+    return connection.vendor == 'postgresql'
+
+
+def update_search_vectors(info_ids):
+    """
+    Пересчитывает поисковые векторы позиций витрины с переданными ИД
+    """
+    info_ids = list(info_ids)
+    if not info_ids or not search_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(SEARCH_VECTOR_SQL, {'config': settings.SEARCH_CONFIG, 'ids': info_ids})
+
+
+def build_search_query(text):
+    """
+    Запрос, в котором каждое слово ищется по префиксу, None - если в строке нет слов
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    return SearchQuery(' & '.join(f'{word}:*' for word in words), search_type='raw', config=settings.SEARCH_CONFIG)
@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import Shop, Category, Product, ProductInfo, Order, OrderItem, Contact, User, ProductParameter
+from .models import Shop, Category, Product, ProductInfo, Order, OrderItem, Contact, User, ProductParameter, \
+    ImportJob, CatalogEntry
 
 
 class ContactSerializer(serializers.ModelSerializer):
@@ -26,10 +27,12 @@ class ShopSerializer(serializers.ModelSerializer):
 
 class CategorySerializer(serializers.ModelSerializer):
     shops = ShopSerializer(many=True)
+    active_shops = serializers.IntegerField(read_only=True)
+    offers = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Category
-        fields = ['name', 'shops']
+        fields = ['id', 'name', 'shops', 'active_shops', 'offers']
 
 
 class ProductSerializer(serializers.ModelSerializer):
@@ -58,11 +61,32 @@ class ProductInfoSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
+class CatalogEntrySerializer(serializers.ModelSerializer):
+    """
+    Позиция витрины каталога в том же виде, что и ProductInfoSerializer
+    """
+    id = serializers.IntegerField(source='product_info_id')
+    product = serializers.SerializerMethodField()
+    product_parameters = serializers.JSONField(source='parameters')
+    shop = serializers.SerializerMethodField()
+
+    class Meta:
+        model = CatalogEntry
+        fields = ('id', 'product', 'product_parameters', 'shop', 'external_id', 'model', 'quantity', 'price',
+                  'price_rrc',)
+
+    def get_product(self, obj):
+        return {'name': obj.product_name, 'category': obj.category_name}
+
+    def get_shop(self, obj):
+        return {'name': obj.shop_name, 'state': obj.shop_state}
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
-        fields = ('id', 'product_info', 'quantity', 'order',)
-        read_only_fields = ('id',)
+        fields = ('id', 'product_info', 'quantity', 'price', 'order',)
+        read_only_fields = ('id', 'price',)
         extra_kwargs = {
             'order': {'write_only': True}
         }
@@ -75,10 +99,37 @@ class OrderItemCreateSerializer(OrderItemSerializer):
 class OrderSerializer(serializers.ModelSerializer):
     ordered_items = OrderItemCreateSerializer(read_only=True, many=True)
 
-    total_sum = serializers.IntegerField()
     contact = ContactSerializer(read_only=True)
 
     class Meta:
         model = Order
         fields = ('id', 'ordered_items', 'status', 'dt', 'total_sum', 'contact',)
-        read_only_fields = ('id',)
+        read_only_fields = ('id', 'total_sum',)
+
+
+class OrderSummarySerializer(serializers.ModelSerializer):
+    """
+    Заказ без позиций для истории заказов
+    """
+    class Meta:
+        model = Order
+        fields = ('id', 'status', 'dt', 'total_sum',)
+        read_only_fields = fields
+
+
+class PartnerOrderSerializer(OrderSerializer):
+    """
+    Заказ для поставщика: только позиции его магазина и сумма по ним
+    """
+    shop_sum = serializers.IntegerField(read_only=True)
+
+    class Meta(OrderSerializer.Meta):
+        fields = ('id', 'ordered_items', 'status', 'dt', 'shop_sum', 'contact',)
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ImportJob
+        fields = ('id', 'state', 'mode', 'rows_parsed', 'rows_written', 'stats', 'error', 'created_at', 'started_at',
+                  'finished_at',)
+        read_only_fields = fields
@@ -0,0 +1,84 @@
+"""
+Синтетические прайс-листы для нагрузочных замеров.
+
+Прайс строится в схеме data/shop1.yaml (shop, categories, goods с parameters) и полностью
+определяется аргументами и seed, поэтому повторный вызов дает тот же прайс, а changed
+меняет цену и остаток у заданной доли товаров.
+"""
+import random
+
+from backend.exporters import dump_yaml
+
+BRANDS = ('apple', 'samsung', 'xiaomi', 'huawei', 'sony', 'lg', 'nokia', 'asus')
+COLORS = ('черный', 'белый', 'красный', 'синий', 'золотистый', 'серебристый')
+CATEGORY_NAMES = ('Смартфоны', 'Аксессуары', 'Flash-накопители', 'Планшеты', 'Ноутбуки', 'Наушники')
+PARAMETERS = (
+    ('Диагональ (дюйм)', lambda rnd: round(rnd.uniform(4, 17), 1)),
+    ('Разрешение (пикс)', lambda rnd: f'{rnd.choice((1280, 1920, 2560, 2688))}x{rnd.choice((720, 1080, 1242))}'),
+    ('Встроенная память (Гб)', lambda rnd: rnd.choice((16, 32, 64, 128, 256, 512))),
+    ('Цвет', lambda rnd: rnd.choice(COLORS)),
+)
+
+
+def synthetic_header(categories=10, shop='Synthetic'):
+    return {'shop': shop,
+            'categories': [{'id': category_id, 'name': f'{CATEGORY_NAMES[category_id % len(CATEGORY_NAMES)]} '
+                                                        f'{category_id}'}
+                           for category_id in range(1, categories + 1)]}
+
+
+def iter_synthetic_goods(goods=1000, categories=10, parameters=4, seed=0, changed=0.0):
+    """
+    Генератор товаров прайса. changed - доля товаров с измененными ценой и остатком
+    """
+    for external_id in range(1, goods + 1):
+        rnd = random.Random(seed * 1_000_003 + external_id)
+        brand = rnd.choice(BRANDS)
+        model = f'{brand}/{rnd.choice(("pro", "lite", "max", "mini"))}/{external_id % 997}'
+        price = rnd.randrange(500, 150000, 10)
+        quantity = rnd.randrange(0, 50)
+        category = rnd.randrange(1, categories + 1)
+        good_parameters = {}
+        for number in range(parameters):
+            if number < len(PARAMETERS):
+                name, value = PARAMETERS[number]
+                good_parameters[name] = value(rnd)
+            else:
+                good_parameters[f'Параметр {number + 1}'] = rnd.randrange(1, 100)
+        # случайные значения товара не зависят от changed, меняются только цена и остаток
+        if rnd.random() < changed:
+            price += 10
+            quantity += 1
+        yield {'id': external_id,
+               'category': category,
+               'model': model,
+               'name': f'{brand.capitalize()} {model.split("/")[1]} {external_id}',
+               'price': price,
+               'price_rrc': price + price // 10,
+               'quantity': quantity,
+               'parameters': good_parameters}
+
+
+def generate_price_list(goods=1000, categories=10, parameters=4, seed=0, changed=0.0, shop='Synthetic'):
+    """
+    Прайс-лист в виде словаря, goods - генератор
+    """
+    return dict(synthetic_header(categories, shop),
+                goods=iter_synthetic_goods(goods, categories, parameters, seed, changed))
+
+
+def write_price_list(stream, goods=1000, categories=10, parameters=4, seed=0, changed=0.0, shop='Synthetic',
+                     chunk_size=1000):
+    """
+    Пишет прайс-лист в YAML по частям, не собирая его в памяти
+    """
+    stream.write(dump_yaml(synthetic_header(categories, shop)))
+    stream.write('goods:\n')
+    chunk = []
+    for good in iter_synthetic_goods(goods, categories, parameters, seed, changed):
+        chunk.append(good)
+        if len(chunk) == chunk_size:
+            stream.write(dump_yaml(chunk))
+            chunk = []
+    if chunk:
+        stream.write(dump_yaml(chunk))
@@ -1,12 +1,22 @@
-from celery import shared_task
+import logging
+import os
+
+from celery import shared_task, chain, chord
 from django.conf import settings
 from django.core.mail import EmailMultiAlternatives
-from yaml import load, FullLoader
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
 
-from backend.models import ConfirmEmailToken, User, Shop, Category, ProductInfo, Product, Parameter, ProductParameter
+from backend.cache import bump_catalog_version
+from backend.exporters import export_catalog
+from backend.feeds import fetch_feed
+from backend.importer import import_price_list, shop_import_lock
+from backend.parsers import read_price_list, detect_format
+from backend.models import ConfirmEmailToken, User, ImportJob, Shop
 from django.dispatch import receiver
 from django_rest_passwordreset.signals import reset_password_token_created
 
+logger = logging.getLogger(__name__)
+
 
 @shared_task()
 def send_email_token_reset_pass_task(user, key, user_email, *args, **kwargs):
@@ -86,30 +96,173 @@ def send_email_new_order_task(user_id, *args, **kwargs):
     return True
 
 
+class ImportProgress:
+    """
+    Счетчики ImportJob после каждой записанной пачки импорта.
+
+    Импорт идет в одной транзакции, поэтому счетчики пишутся отдельным соединением с базой,
+    иначе до конца импорта их никто не увидит. SQLite допускает одну пишущую транзакцию,
+    на нем счетчики появляются только по завершении импорта
+    """
+    def __init__(self, job_id):
+        self.job_id = job_id if connections[DEFAULT_DB_ALIAS].vendor != 'sqlite' else None
+        self.connection = None
+
+    def __call__(self, stats):
+        if not self.job_id:
+            return
+        try:
+            if self.connection is None:
+                self.connection = connections.create_connection(DEFAULT_DB_ALIAS)
+            with self.connection.cursor() as cursor:
+                cursor.execute(f'UPDATE {ImportJob._meta.db_table} SET rows_parsed = %s, rows_written = %s '
+                               f'WHERE id = %s', [stats['rows'], stats['created'] + stats['updated'], self.job_id])
+        except DatabaseError as error:
+            # ход выполнения не должен прерывать импорт
+            logger.warning('Import job %s progress is not saved: %s', self.job_id, error)
+            self.job_id = None
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+
+def run_import(task, shop_id=None, mode=None, job_id=None, force=False):
+    """
+    импорт прайса. Если у магазина shop_id задан url, прайс скачивается по нему условным запросом
+    и пропускается, если не изменился (force - импортировать в любом случае), иначе читается PATH_TO_FILE.
+    mode - 'full' (полная перезапись) или 'incremental' (только изменения).
+    Ход выполнения пишется в ImportJob с ИД job_id
+    """
+    job = ImportJob.objects.filter(id=job_id).first() if job_id else None
+    if job:
+        job.mark_running(task.request.id)
+    progress = ImportProgress(job and job.id)
+
+    def skip(reason):
+        stats = {'shop': shop_id, 'skipped': True, 'reason': reason}
+        if job:
+            job.mark_skipped(stats)
+        return stats
+
+    try:
+        if not shop_id:
+            stats = import_file(None, mode, progress)
+        else:
+            with shop_import_lock(shop_id) as acquired:
+                if not acquired:
+                    return skip('locked')
+                stats = import_shop(Shop.objects.get(id=shop_id), mode, force, progress)
+                if stats is None:
+                    return skip('not modified')
+    except Exception as error:
+        if job:
+            job.mark_failed(error)
+        raise
+    finally:
+        progress.close()
+    bump_catalog_version()
+    if job:
+        job.mark_finished(stats)
+    return stats
+
+
+def import_file(shop, mode, progress):
+    """
+    импорт прайса из PATH_TO_FILE, без магазина он ищется по имени из файла
+    """
+    with open(settings.PATH_TO_FILE, 'rb') as fh:
+        # товары читаются из файла потоково, пачками по IMPORT_BATCH_SIZE
+        header, goods = read_price_list(fh, detect_format(settings.PATH_TO_FILE))
+        return import_price_list(dict(header, goods=goods), shop=shop, mode=mode, progress=progress)
+
+
+def import_shop(shop, mode, force, progress):
+    """
+    импорт прайса магазина, None - если прайс по ссылке не изменился.
+    Без ссылки импортируется PATH_TO_FILE в магазин, указанный в файле
+    """
+    if not shop.url:
+        return import_file(None, mode, progress)
+
+    feed = fetch_feed(shop)
+    if feed is None:
+        return None
+    with feed:
+        if not (force or feed.is_changed(shop)):
+            feed.remember(shop)
+            return None
+        header, goods = read_price_list(feed.file, feed.format)
+        stats = import_price_list(dict(header, goods=goods), shop=shop, mode=mode, progress=progress)
+        feed.remember(shop)
+    return stats
+
+
+@shared_task(bind=True)
+def do_import_task(self, *args, shop_id=None, mode=None, job_id=None, force=False, **kwargs):
+    return run_import(self, shop_id=shop_id, mode=mode, job_id=job_id, force=force)
+
+
+@shared_task(bind=True)
+def import_shop_task(self, shop_id, job_id, mode=None, force=False):
+    """
+    подзадача планировщика: ошибка импорта одного магазина не прерывает обновление остальных
+    """
+    try:
+        return run_import(self, shop_id=shop_id, mode=mode, job_id=job_id, force=force)
+    except Exception as error:
+        return {'shop': shop_id, 'error': str(error)}
+
+
 @shared_task()
-def do_import_task(*args, **kwargs):
-    with open(settings.PATH_TO_FILE) as fh:
-        # Load YAML data from the file
-        read_data = load(fh, Loader=FullLoader)
-    shop, _ = Shop.objects.get_or_create(name=read_data['shop'])
-    for cate_gory in read_data['categories']:
-        category, _ = Category.objects.get_or_create(id=cate_gory['id'], name=cate_gory['name'])
-        category.shops.add(shop.id)
-        category.save()
-        ProductInfo.objects.filter(shop_id=shop.id).delete()
-        for item in read_data['goods']:
-            product, _ = Product.objects.get_or_create(name=item['name'], category_id=item['category'])
-            product_info = ProductInfo.objects.create(product_id=product.id,
-                                                      shop_id=shop.id,
-                                                      external_id=item['id'],
-                                                      model=item['model'],
-                                                      quantity=item['quantity'],
-                                                      price=item['price'],
-                                                      price_rrc=item['price_rrc'])
-            for param_name, param_val in item['parameters'].items():
-                parameter, _ = Parameter.objects.get_or_create(name=param_name)
-                ProductParameter.objects.create(product_info_id=product_info.id,
-                                                parameter_id=parameter.id,
-                                                value=param_val)
-    return True
+def refresh_all_shops_task(concurrency=None, mode=None, force=False):
+    """
+    обновление прайсов всех магазинов с заданным url.
+    Магазины раскладываются по concurrency цепочкам подзадач, цепочки выполняются параллельно,
+    поэтому одновременно идет не больше concurrency импортов. Итог собирает summarize_imports_task
+    """
+    jobs = [ImportJob.objects.create(shop_id=shop_id, user_id=user_id, mode=mode or settings.IMPORT_MODE)
+            for shop_id, user_id in Shop.objects.exclude(url__isnull=True).exclude(url='').order_by('id').values_list(
+                'id', 'user_id')]
+    job_ids = [job.id for job in jobs]
+    if not jobs:
+        return summarize_imports_task(job_ids)
 
+    concurrency = max(1, min(concurrency or settings.IMPORT_CONCURRENCY, len(jobs)))
+    lanes = [chain(*[import_shop_task.si(job.shop_id, job.id, mode, force) for job in jobs[lane::concurrency]])
+             for lane in range(concurrency)]
+    result = chord(lanes)(summarize_imports_task.si(job_ids))
+    return {'shops': len(jobs), 'jobs': job_ids, 'summary_task_id': result.id}
+
+
+@shared_task()
+def summarize_imports_task(job_ids):
+    """
+    итог обновления прайсов: состояние и длительность импорта по каждому магазину
+    """
+    shops = []
+    states = {}
+    for job in ImportJob.objects.filter(id__in=job_ids).order_by('shop_id'):
+        seconds = None
+        if job.started_at and job.finished_at:
+            seconds = round((job.finished_at - job.started_at).total_seconds(), 3)
+        shops.append({'shop': job.shop_id, 'job': job.id, 'state': job.state, 'seconds': seconds,
+                      'rows': job.rows_parsed, 'error': job.error})
+        states[job.state] = states.get(job.state, 0) + 1
+    return {'shops': shops, 'states': states, 'total': len(shops),
+            'seconds': round(sum(shop['seconds'] or 0 for shop in shops), 3)}
+
+
+@shared_task()
+def do_export_task(shop_id, export_format='yaml', path=None):
+    """
+    выгрузка каталога магазина в файл, по умолчанию в EXPORT_DIR
+    """
+    shop = Shop.objects.get(id=shop_id)
+    if path is None:
+        os.makedirs(settings.EXPORT_DIR, exist_ok=True)
+        path = os.path.join(settings.EXPORT_DIR, f'shop_{shop.id}.{export_format}')
+    with open(path, 'w', encoding='utf-8') as fh:
+        for chunk in export_catalog(shop, export_format):
+            fh.write(chunk)
+    return path
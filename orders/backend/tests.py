@@ -1,3 +1,692 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import random
+import socket
+import tempfile
+import threading
+from email.message import Message
+from unittest import mock, skipUnless
+from urllib.request import HTTPHandler, addinfourl, build_opener
 
-# Create your tests here.
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from backend.basket import OrderPlacementError, place_order, rebuild_summary
+from backend.cache import bump_catalog_version, get_cache
+from backend.catalog import refresh_catalog_entries
+from backend.exporters import export_catalog, iter_goods
+from backend.feeds import FeedError, FeedURLError, fetch_feed, feed_url
+from backend.importer import import_price_list
+from backend.parsers import JSON_LINES, YAML, PriceListFormatError, read_price_list
+from backend.models import BasketSummary, CatalogEntry, Category, Contact, ImportJob, Order, OrderItem, Product, \
+    ProductInfo, Shop, User
+from backend.tasks import do_import_task
+
+
+class CategoryViewQueriesTest(TestCase):
+    """
+    Список категорий читается постоянным числом запросов
+    """
+    def setUp(self):
+        # ответы каталога и счетчики ограничения запросов хранятся в кэше
+        get_cache().clear()
+        caches['default'].clear()
+        self.active = Shop.objects.create(name='active')
+        self.inactive = Shop.objects.create(name='inactive', state=False)
+
+    def add_categories(self, count):
+        for _ in range(count):
+            category = Category.objects.create(name=f'category {Category.objects.count()}')
+            category.shops.add(self.active, self.inactive)
+            product = Product.objects.create(name='product', category=category)
+            infos = [ProductInfo.objects.create(product=product, shop=shop, external_id=category.id, model='model',
+                                                quantity=1, price=100) for shop in (self.active, self.inactive)]
+            refresh_catalog_entries([info.id for info in infos])
+
+    def get_categories(self, queries):
+        get_cache().clear()
+        caches['default'].clear()
+        with self.assertNumQueries(queries):
+            response = self.client.get(reverse('categories'))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_constant_query_count(self):
+        self.add_categories(2)
+        self.assertEqual(len(self.get_categories(2)), 2)
+        self.add_categories(8)
+        categories = self.get_categories(2)
+        self.assertEqual(len(categories), 10)
+        self.assertEqual({(category['active_shops'], category['offers'], len(category['shops']))
+                          for category in categories}, {(1, 1, 2)})
+
+
+@skipUnless(connection.features.has_select_for_update, 'Stock reservation relies on SELECT ... FOR UPDATE')
+class OrderPlacementConcurrencyTest(TransactionTestCase):
+    """
+    Одновременное размещение заказов не продает больше остатка и не приводит к взаимоблокировкам
+    """
+    buyers = 20
+
+    def setUp(self):
+        get_cache().clear()
+        shop = Shop.objects.create(name='shop')
+        category = Category.objects.create(name='category')
+        self.infos = [ProductInfo.objects.create(product=Product.objects.create(name=f'product {number}',
+                                                                                category=category),
+                                                 shop=shop, external_id=number, model='model', quantity=quantity,
+                                                 price=100)
+                      for number, quantity in enumerate((5, 10, 15))]
+        refresh_catalog_entries([info.id for info in self.infos])
+        self.baskets = []
+        for number in range(self.buyers):
+            user = User.objects.create_user(email=f'buyer{number}@example.com', password='password')
+            contact = Contact.objects.create(user=user, phone='1', city='city', street='street', house='1')
+            basket = Order.objects.create(user=user, status='basket')
+            # строки в разном порядке, чтобы заказы пытались брать позиции вперемешку
+            for info in random.sample(self.infos, len(self.infos)):
+                OrderItem.objects.create(order=basket, product_info=info, quantity=1)
+            self.baskets.append((user.id, basket.id, contact.id))
+
+    def place_concurrently(self, partial):
+        barrier = threading.Barrier(self.buyers)
+        placed, errors = [], []
+
+        def place(user_id, basket_id, contact_id):
+            try:
+                barrier.wait()
+                place_order(user_id, basket_id, contact_id, partial)
+                placed.append(basket_id)
+            except OrderPlacementError:
+                pass
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=place, args=basket) for basket in self.baskets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return placed
+
+    def reserved(self, info):
+        return OrderItem.objects.filter(order__status='new', product_info=info).aggregate(
+            total=Sum('quantity'))['total'] or 0
+
+    def test_reject_without_stock(self):
+        placed = self.place_concurrently(partial=False)
+        self.assertEqual(len(placed), 5)
+        for info, initial in zip(self.infos, (5, 10, 15)):
+            info.refresh_from_db()
+            self.assertEqual(info.quantity, initial - 5)
+            self.assertEqual(info.catalog_entry.quantity, info.quantity)
+            self.assertEqual(self.reserved(info), 5)
+
+    def test_partial_fulfilment(self):
+        placed = self.place_concurrently(partial=True)
+        self.assertEqual(len(placed), 15)
+        for info, initial in zip(self.infos, (5, 10, 15)):
+            info.refresh_from_db()
+            self.assertEqual(info.quantity, 0)
+            self.assertEqual(self.reserved(info), initial)
+
+
+class IncrementalImportTest(TestCase):
+    """
+    Повторный импорт измененного прайса меняет только отличающиеся позиции и не трогает корзины
+    """
+    backend = 'orm'
+
+    def setUp(self):
+        self.shop = Shop.objects.create(name='shop')
+
+    @staticmethod
+    def price_list(goods):
+        return {'shop': 'shop', 'categories': [{'id': 1, 'name': 'category'}],
+                'goods': [dict({'category': 1, 'model': 'model', 'price_rrc': 0}, **good) for good in goods]}
+
+    def import_goods(self, goods):
+        return import_price_list(self.price_list(goods), shop=self.shop, mode='incremental', backend=self.backend)
+
+    def infos(self):
+        return {info.external_id: info for info in ProductInfo.objects.filter(shop=self.shop)}
+
+    def test_renamed_product_keeps_position(self):
+        goods = [{'id': 1, 'name': 'phone', 'price': 100, 'quantity': 5, 'parameters': {'color': 'black'}}]
+        self.import_goods(goods)
+        info = ProductInfo.objects.get(shop=self.shop)
+        user = User.objects.create_user(email='buyer@example.com', password='password')
+        order_item = OrderItem.objects.create(order=Order.objects.create(user=user, status='basket'),
+                                              product_info=info, quantity=1)
+
+        stats = self.import_goods([dict(goods[0], name='phone 2')])
+        self.assertEqual((stats['created'], stats['updated'], stats['retired']), (0, 1, 0))
+        renamed = ProductInfo.objects.get(shop=self.shop)
+        self.assertEqual((renamed.id, renamed.product.name, renamed.quantity), (info.id, 'phone 2', 5))
+        self.assertEqual(CatalogEntry.objects.get(product_info=renamed).product_name, 'phone 2')
+        self.assertTrue(OrderItem.objects.filter(id=order_item.id, product_info=renamed).exists())
+
+    def test_reimport_changed_feed(self):
+        goods = [{'id': 1, 'name': 'phone', 'price': 100, 'quantity': 5, 'parameters': {'color': 'black'}},
+                 {'id': 2, 'name': 'tablet', 'price': 200, 'quantity': 5, 'parameters': {'color': 'white'}},
+                 {'id': 3, 'name': 'laptop', 'price': 300, 'quantity': 5, 'parameters': {}},
+                 {'id': 4, 'name': 'watch', 'price': 400, 'quantity': 5, 'parameters': {}}]
+        stats = self.import_goods(goods)
+        self.assertEqual((stats['created'], stats['updated'], stats['unchanged'], stats['retired']), (4, 0, 0, 0))
+        before = self.infos()
+
+        user = User.objects.create_user(email='buyer@example.com', password='password')
+        basket = Order.objects.create(user=user, status='basket')
+        for external_id in (1, 4):
+            OrderItem.objects.create(order=basket, product_info=before[external_id], quantity=1)
+
+        goods[0] = dict(goods[0], price=150)
+        goods[1] = dict(goods[1], parameters={'color': 'red', 'memory': '64'})
+        stats = self.import_goods(goods[:3] + [{'id': 5, 'name': 'camera', 'price': 500, 'quantity': 1,
+                                                 'parameters': {}}])
+        self.assertEqual((stats['created'], stats['updated'], stats['unchanged'], stats['retired']), (1, 2, 1, 1))
+
+        after = self.infos()
+        self.assertEqual({external_id: after[external_id].id for external_id in before},
+                         {external_id: info.id for external_id, info in before.items()})
+        self.assertEqual(after[1].price, 150)
+        self.assertEqual(dict(after[2].product_parameters.values_list('parameter__name', 'value')),
+                         {'color': 'red', 'memory': '64'})
+        self.assertEqual(after[4].quantity, 0)
+        self.assertEqual(CatalogEntry.objects.get(product_info=after[4]).quantity, 0)
+        self.assertEqual(set(basket.ordered_items.values_list('product_info_id', flat=True)),
+                         {after[1].id, after[4].id})
+
+        stats = self.import_goods(goods[:3])
+        self.assertEqual((stats['created'], stats['updated'], stats['unchanged']), (0, 0, 3))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'COPY import backend requires PostgreSQL')
+class IncrementalCopyImportTest(IncrementalImportTest):
+    """
+    Инкрементальный импорт через COPY дает тот же результат, что и через ORM
+    """
+    backend = 'copy'
+
+    def test_same_result_as_orm(self):
+        goods = [{'id': number, 'name': f'product {number}', 'price': 100 * number, 'quantity': number,
+                  'parameters': {'color': 'black', 'size': str(number)}} for number in range(1, 6)]
+        changed = [dict(goods[0], name='product renamed'), dict(goods[1], price=1), dict(goods[2], parameters={}),
+                   goods[3], {'id': 6, 'name': 'product 6', 'price': 600, 'quantity': 6, 'parameters': {}}]
+        results = []
+        for backend in ('orm', 'copy'):
+            self.backend, self.shop = backend, Shop.objects.create(name=backend)
+            self.import_goods(goods)
+            stats = self.import_goods(changed)
+            rows = {(info.external_id, info.product.name, info.quantity, info.price,
+                     tuple(sorted(info.product_parameters.values_list('parameter__name', 'value'))))
+                    for info in ProductInfo.objects.filter(shop=self.shop).select_related('product')}
+            results.append(({key: stats[key] for key in ('created', 'updated', 'unchanged', 'retired')}, rows))
+        self.assertEqual(results[0], results[1])
+
+
+class PartnerUpdateWithoutURLTest(TestCase):
+    """
+    Без ссылки на прайс импортируется PATH_TO_FILE в магазин из файла, позиции магазина пользователя не меняются
+    """
+    def setUp(self):
+        caches['default'].clear()
+        handle, self.path = tempfile.mkstemp(suffix='.yaml')
+        with os.fdopen(handle, 'w', encoding='utf-8') as file:
+            file.write('shop: file shop\ncategories:\n  - id: 1\n    name: category\ngoods:\n'
+                       '  - {id: 1, category: 1, model: model, name: phone, price: 100, price_rrc: 0, quantity: 3,'
+                       ' parameters: {}}\n')
+        self.addCleanup(os.unlink, self.path)
+        self.user = User.objects.create_user(email='partner@example.com', password='password', type='shop')
+        self.shop = Shop.objects.create(name='own shop', user=self.user)
+        self.info = ProductInfo.objects.create(
+            product=Product.objects.create(name='own product', category=Category.objects.create(name='own')),
+            shop=self.shop, external_id=1, model='model', quantity=5, price=100)
+
+    def assert_file_imported(self):
+        self.info.refresh_from_db()
+        self.assertEqual(self.info.quantity, 5)
+        imported = ProductInfo.objects.filter(shop__name='file shop')
+        self.assertEqual(list(imported.values_list('external_id', 'quantity')), [(1, 3)])
+
+    def test_partner_update(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with override_settings(PATH_TO_FILE=self.path), \
+                mock.patch('backend.views.do_import_task.delay', lambda **kwargs: do_import_task.apply(kwargs=kwargs)):
+            response = client.post(reverse('partner-update'), {'mode': 'incremental'})
+        self.assertEqual(response.status_code, 202)
+        job = ImportJob.objects.get(id=response.json()['job_id'])
+        self.assertEqual((job.state, job.shop_id), ('success', None))
+        self.assert_file_imported()
+
+    def test_import_task(self):
+        for mode in ('incremental', 'full'):
+            with override_settings(PATH_TO_FILE=self.path):
+                do_import_task.apply(kwargs={'shop_id': self.shop.id, 'mode': mode}).get()
+            self.assert_file_imported()
+
+
+class YamlPriceListReaderTest(TestCase):
+    """
+    Заголовок прайса читается и тогда, когда он записан после товаров
+    """
+    goods = ('goods:\n'
+             '  - {id: 1, category: 1, model: model, name: phone, price: 100, price_rrc: 0, quantity: 3,'
+             ' parameters: {color: black}}\n'
+             '  - {id: 2, category: 1, model: model, name: tablet, price: 200, price_rrc: 0, quantity: 1,'
+             ' parameters: {}}\n')
+    categories = 'categories:\n  - id: 1\n    name: category\n'
+
+    def read(self, text):
+        header, goods = read_price_list(io.BytesIO(text.encode()))
+        return header, list(goods)
+
+    def test_header_before_goods(self):
+        header, goods = self.read('shop: shop\n' + self.categories + self.goods)
+        self.assertEqual(header, {'shop': 'shop', 'categories': [{'id': 1, 'name': 'category'}]})
+        self.assertEqual([good['id'] for good in goods], [1, 2])
+
+    def test_header_after_goods(self):
+        header, goods = self.read(self.goods + self.categories + 'shop: shop\n')
+        self.assertEqual(header, {'shop': 'shop', 'categories': [{'id': 1, 'name': 'category'}]})
+        self.assertEqual([good['id'] for good in goods], [1, 2])
+
+        stats = import_price_list(dict(header, goods=iter(goods)))
+        self.assertEqual((stats['created'], stats['rows']), (2, 2))
+        self.assertEqual(ProductInfo.objects.filter(shop__name='shop').count(), 2)
+
+    def test_missing_header(self):
+        with self.assertRaisesMessage(PriceListFormatError, "Price list has no 'categories'"):
+            self.read('shop: shop\n' + self.goods)
+        header, goods = self.read(self.categories + self.goods)
+        with self.assertRaisesMessage(PriceListFormatError, "Price list has no 'shop'"):
+            import_price_list(dict(header, goods=iter(goods)))
+
+
+class FakeHTTPHandler(HTTPHandler):
+    """
+    Отдает заранее заданные ответы вместо обращения к сети
+    """
+    def __init__(self, responses):
+        super().__init__()
+        self.responses = responses
+        self.requests = []
+
+    def http_open(self, request):
+        self.requests.append(request)
+        code, headers, body = self.responses[request.full_url](request)
+        message = Message()
+        for name, value in headers.items():
+            message[name] = value
+        response = addinfourl(io.BytesIO(body), message, request.full_url, code)
+        response.msg = str(code)
+        return response
+
+
+@override_settings(FEED_ALLOW_LOCAL_FILES=False)
+class FeedURLTest(TestCase):
+    """
+    Прайс скачивается только с публичных http(s) адресов, в том числе после редиректа
+    """
+    hosts = {'feed.example.com': '93.184.216.34', 'internal.example.com': '10.0.0.5',
+             'loopback.example.com': '127.0.0.1', 'metadata.example.com': '169.254.169.254'}
+
+    def setUp(self):
+        def resolve(host, port, *args, **kwargs):
+            if host not in self.hosts:
+                raise socket.gaierror(host)
+            return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (self.hosts[host], port))]
+
+        patcher = mock.patch('backend.feeds.socket.getaddrinfo', side_effect=resolve)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.shop = Shop.objects.create(name='shop', url='http://feed.example.com/shop.yaml')
+
+    def serve(self, responses):
+        handler = FakeHTTPHandler(responses)
+        patcher = mock.patch('backend.feeds.build_opener', lambda *handlers: build_opener(*handlers, handler))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return handler
+
+    def test_feed_url(self):
+        self.assertEqual(feed_url(self.shop.url), self.shop.url)
+        for url in ('http://internal.example.com/shop.yaml', 'http://loopback.example.com/shop.yaml',
+                    'http://metadata.example.com/latest', 'http://127.0.0.1/shop.yaml', 'http://[::1]/shop.yaml',
+                    'http://unknown.example.com/shop.yaml', 'ftp://feed.example.com/shop.yaml',
+                    'file:///etc/passwd', '/etc/passwd', 'http://feed.example.com/' + 'a' * 200):
+            with self.subTest(url=url), self.assertRaises(FeedURLError):
+                feed_url(url)
+
+    def test_redirect_to_private_host(self):
+        # на file:// не переходит уже urllib, ответ с редиректом становится ошибкой загрузки
+        for location, error in (('http://internal.example.com/shop.yaml', FeedURLError),
+                                ('http://loopback.example.com/shop.yaml', FeedURLError),
+                                ('file:///etc/passwd', FeedError)):
+            handler = self.serve({self.shop.url: lambda request: (302, {'Location': location}, b'')})
+            with self.subTest(location=location), self.assertRaises(error):
+                fetch_feed(self.shop)
+            self.assertEqual([request.full_url for request in handler.requests], [self.shop.url])
+
+    def test_not_modified(self):
+        def respond(request):
+            if request.get_header('If-none-match') == '"v1"':
+                return 304, {}, b''
+            return 200, {'ETag': '"v1"'}, b'shop: shop\n'
+
+        handler = self.serve({self.shop.url: respond})
+        with fetch_feed(self.shop) as feed:
+            self.assertEqual((feed.file.read(), feed.etag), (b'shop: shop\n', '"v1"'))
+            feed.remember(self.shop)
+        self.assertIsNone(fetch_feed(self.shop))
+        self.assertEqual(handler.requests[-1].get_header('If-none-match'), '"v1"')
+        self.assertEqual(Shop.objects.get(id=self.shop.id).feed_etag, '"v1"')
+
+
+class CatalogResponseCacheTest(TestCase):
+    """
+    Ответы каталога берутся из кэша до смены версии каталога, совпавший ETag дает 304
+    """
+    def setUp(self):
+        get_cache().clear()
+        caches['default'].clear()
+        self.user = User.objects.create_user(email='partner@example.com', password='password', type='shop')
+        Shop.objects.create(name='shop', user=self.user)
+
+    def get_shops(self, queries, **headers):
+        with self.assertNumQueries(queries):
+            return self.client.get(reverse('shops'), **headers)
+
+    def test_version_bump(self):
+        response = self.get_shops(1)
+        etag = response['ETag']
+        self.assertEqual([shop['name'] for shop in response.json()], ['shop'])
+
+        Shop.objects.create(name='new shop')
+        cached = self.get_shops(0)
+        self.assertEqual((cached['ETag'], cached.json()), (etag, response.json()))
+        self.assertEqual(self.get_shops(0, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        bump_catalog_version()
+        response = self.get_shops(1, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual([shop['name'] for shop in response.json()], ['shop', 'new shop'])
+
+    def test_shop_state_bumps_version(self):
+        etag = self.get_shops(1)['ETag']
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertTrue(client.post(reverse('partner-state'), {'state': 'off'}).json()['Status'])
+
+        response = self.get_shops(1, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+
+
+class CatalogExportTest(TestCase):
+    """
+    Выгрузка каталога читается пачками и в YAML и JSON Lines снова читается импортом
+    """
+    price_list = {'shop': 'shop', 'categories': [{'id': 1, 'name': 'category'}, {'id': 2, 'name': 'other'}],
+                  'goods': [{'id': number, 'category': 1 + number % 2, 'model': f'model {number}',
+                             'name': f'product {number}', 'price': 100 * number, 'price_rrc': 110 * number,
+                             'quantity': number, 'parameters': {'color': 'black', 'size': str(number)}}
+                            for number in range(1, 6)]}
+
+    def setUp(self):
+        import_price_list(dict(self.price_list, goods=iter(self.price_list['goods'])))
+        self.shop = Shop.objects.get(name='shop')
+
+    def export(self, export_format):
+        return ''.join(export_catalog(self.shop, export_format, chunk_size=2))
+
+    def test_chunks(self):
+        with self.assertNumQueries(4):
+            chunks = list(iter_goods(self.shop, chunk_size=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual([good for chunk in chunks for good in chunk], self.price_list['goods'])
+
+    def test_round_trip(self):
+        for export_format, fmt in (('yaml', YAML), ('jsonl', JSON_LINES)):
+            with self.subTest(export_format=export_format):
+                header, goods = read_price_list(io.StringIO(self.export(export_format)), fmt)
+                self.assertEqual(dict(header, goods=list(goods)), self.price_list)
+
+        header, goods = read_price_list(io.StringIO(self.export('yaml')))
+        stats = import_price_list(dict(header, goods=goods), shop=self.shop, mode='incremental')
+        self.assertEqual((stats['unchanged'], stats['created'], stats['updated']), (5, 0, 0))
+
+    def test_endpoint(self):
+        user = User.objects.create_user(email='partner@example.com', password='password', type='shop')
+        Shop.objects.filter(id=self.shop.id).update(user=user)
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get(reverse('partner-export'), {'export_format': 'jsonl'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        self.assertEqual(b''.join(response.streaming_content).decode(), self.export('jsonl'))
+
+    def test_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.export('csv'))))
+        self.assertEqual([dict(row, parameters=json.loads(row['parameters'])) for row in rows],
+                         [{key: value if key == 'parameters' else str(value) for key, value in good.items()}
+                          for good in self.price_list['goods']])
+
+
+class BasketTestMixin:
+    def setUp(self):
+        get_cache().clear()
+        caches['default'].clear()
+        category = Category.objects.create(name='category')
+        self.shop, other, closed = (Shop.objects.create(name='shop 1'), Shop.objects.create(name='shop 2'),
+                                    Shop.objects.create(name='closed', state=False))
+        # позиции: 0 - 100 в shop 1, 1 - 40 в shop 2, 2 - закрытый магазин, 3-12 - по 250 в shop 1
+        self.infos = [ProductInfo.objects.create(product=Product.objects.create(name=f'product {number}',
+                                                                                category=category),
+                                                 shop=shop, external_id=number, model='model', quantity=100,
+                                                 price=price)
+                      for number, (shop, price) in enumerate([(self.shop, 100), (other, 40), (closed, 10)] +
+                                                             [(self.shop, 250)] * 10)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.create_user('buyer@example.com'))
+
+    @staticmethod
+    def create_user(email):
+        return User.objects.create_user(email=email, password='password')
+
+    def basket(self, method, items):
+        return getattr(self.client, method)(reverse('basket'), {'items': items}, format='json').json()
+
+
+class BasketBulkTest(BasketTestMixin, TestCase):
+    """
+    Строки корзины проверяются и пишутся пачкой, ошибки возвращаются по номерам строк
+    """
+    def test_line_errors(self):
+        closed, info = self.infos[2], self.infos[0]
+        response = self.basket('post', [{'product_info': info.id, 'quantity': 2}, {'product_info': 'x', 'quantity': 1},
+                                        {'product_info': self.infos[1].id, 'quantity': 0},
+                                        {'product_info': info.id, 'quantity': 3},
+                                        {'product_info': closed.id, 'quantity': 1},
+                                        {'product_info': 10 ** 9, 'quantity': 1}])
+        self.assertEqual(response, {'Status': True, 'Objects created': 1, 'Objects updated': 0, 'Errors': {
+            '1': 'product_info must be an integer', '2': 'quantity must be a positive integer',
+            '3': 'Duplicate product_info', '4': 'Product not found or shop is not active',
+            '5': 'Product not found or shop is not active'}})
+
+        response = self.basket('post', [{'product_info': info.id, 'quantity': 4},
+                                        {'product_info': self.infos[1].id, 'quantity': 1}])
+        self.assertEqual((response['Objects created'], response['Objects updated']), (1, 1))
+        self.assertEqual(dict(OrderItem.objects.values_list('product_info_id', 'quantity')),
+                         {info.id: 4, self.infos[1].id: 1})
+
+    def test_query_count_independent_of_lines(self):
+        counts = []
+        for count in (2, 10):
+            self.client.force_authenticate(self.create_user(f'buyer{count}@example.com'))
+            items = [{'product_info': info.id, 'quantity': 1} for info in self.infos[3:3 + count]]
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.basket('post', items)['Objects created'], count)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class BasketSummaryTest(BasketTestMixin, TestCase):
+    """
+    Итоги корзины меняются на разницу каждой операции и совпадают с пересчетом по строкам
+    """
+    def assert_summary(self, lines, quantity, total_sum, shops):
+        summary = self.client.get(reverse('basket')).json()
+        # в кэше и в базе одни и те же итоги, измененные операциями корзины
+        self.assertEqual(summary, BasketSummary.objects.get(order_id=summary['id']).as_dict())
+        self.assertEqual((summary['lines'], summary['quantity'], summary['total_sum']), (lines, quantity, total_sum))
+        self.assertEqual([(shop['id'], shop['lines'], shop['quantity'], shop['sum']) for shop in summary['shops']],
+                         shops)
+
+    def test_incremental_totals(self):
+        phone, case, tablet = self.infos[0], self.infos[1], self.infos[3]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.basket('post', [{'product_info': phone.id, 'quantity': 2}, {'product_info': tablet.id, 'quantity': 1},
+                                 {'product_info': case.id, 'quantity': 5}])
+        self.assert_summary(3, 8, 650, [(self.shop.id, 2, 3, 450), (case.shop_id, 1, 5, 200)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.basket('put', [{'id': phone.id, 'quantity': 5}])
+        self.assert_summary(3, 11, 950, [(self.shop.id, 2, 6, 750), (case.shop_id, 1, 5, 200)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.basket('delete', [case.id])
+        self.assert_summary(2, 6, 750, [(self.shop.id, 2, 6, 750)])
+        basket = Order.objects.get(status='basket')
+        self.assertEqual(BasketSummary.objects.get(order=basket).as_dict(), rebuild_summary(basket.id).as_dict())
+
+    def test_stale_summary_rebuilt(self):
+        phone = self.infos[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.basket('post', [{'product_info': phone.id, 'quantity': 2}])
+        # импорт поменял цену и пометил итоги устаревшими
+        ProductInfo.objects.filter(id=phone.id).update(price=120)
+        BasketSummary.objects.update(is_stale=True)
+        get_cache().clear()
+        self.assert_summary(1, 2, 240, [(self.shop.id, 1, 2, 240)])
+        self.assertFalse(BasketSummary.objects.get().is_stale)
+
+
+class ProductListTest(TestCase):
+    """
+    Фильтры списка товаров, ошибки в параметрах и постраничный вывод по курсору и по limit/offset
+    """
+    def setUp(self):
+        get_cache().clear()
+        colors = ('black', 'white', 'red', 'black', 'white', 'black')
+        for shop in ('shop 1', 'shop 2'):
+            goods = [{'id': number, 'category': 1, 'model': 'model', 'name': f'product {number}',
+                      'price': 100 * number, 'price_rrc': 0, 'quantity': 1,
+                      'parameters': {'color': color, 'memory': '64' if number % 2 else '128'}}
+                     for number, color in enumerate(colors, 1)]
+            import_price_list({'shop': shop, 'categories': [{'id': 1, 'name': 'category'}], 'goods': iter(goods)})
+        self.shop = Shop.objects.get(name='shop 1')
+
+    def get(self, **params):
+        # анонимные запросы ограничены по частоте, счетчики лежат в кэше default
+        caches['default'].clear()
+        return self.client.get(reverse('products'), params)
+
+    def external_ids(self, **params):
+        response = self.get(**params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(product['external_id'] for product in response.json()['results'])
+
+    def test_filters(self):
+        self.assertEqual(self.external_ids(shop_id=self.shop.id), [1, 2, 3, 4, 5, 6])
+        self.assertEqual(self.external_ids(shop_id=self.shop.id, parameter='color:black'), [1, 4, 6])
+        self.assertEqual(self.external_ids(shop_id=self.shop.id, parameter=['color:black', 'color:red']),
+                         [1, 3, 4, 6])
+        self.assertEqual(self.external_ids(shop_id=self.shop.id, parameter=['color:black', 'memory:128']), [4, 6])
+        self.assertEqual(self.external_ids(shop_id=self.shop.id, parameter='color:green'), [])
+        self.assertEqual(self.external_ids(shop_id=self.shop.id, price_min=200, price_max=400), [2, 3, 4])
+        self.assertEqual(len(self.external_ids(parameter='memory:64')), 6)
+
+    def test_invalid_filters(self):
+        for params, error in (({'price_min': 'abc'}, 'price_min must be an integer'),
+                              ({'shop_id': '1.5'}, 'shop_id must be an integer'),
+                              ({'parameter': 'color'}, "Parameter filter must look like <name>:<value>, got 'color'")):
+            with self.subTest(params=params):
+                response = self.get(**params)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'Status': False, 'Error': error})
+
+    def test_cursor_pages(self):
+        response = self.get(limit=5).json()
+        self.assertNotIn('count', response)
+        self.assertEqual(sum(facet['count'] for facet in response['facets']['shops']), 12)
+        pages, ids = 1, [product['id'] for product in response['results']]
+        while response['next']:
+            caches['default'].clear()
+            response = self.client.get(response['next']).json()
+            self.assertNotIn('facets', response)
+            pages += 1
+            ids += [product['id'] for product in response['results']]
+        self.assertEqual(pages, 3)
+        self.assertEqual(ids, sorted(CatalogEntry.objects.values_list('pk', flat=True)))
+
+    def test_offset_pages(self):
+        ids = sorted(CatalogEntry.objects.values_list('pk', flat=True))
+        response = self.get(limit=5, offset=0).json()
+        self.assertEqual((response['count'], [product['id'] for product in response['results']]), (12, ids[:5]))
+        self.assertIn('facets', response)
+        response = self.get(limit=5, offset=10).json()
+        self.assertEqual([product['id'] for product in response['results']], ids[10:])
+        self.assertIsNone(response['next'])
+        self.assertNotIn('facets', response)
+
+
+@skipUnless(connection.vendor != 'sqlite', 'SQLite allows only one writing transaction')
+class ImportProgressTest(TransactionTestCase):
+    """
+    Счетчики задачи импорта видны другим соединениям до завершения импорта
+    """
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.yaml')
+        with os.fdopen(handle, 'w', encoding='utf-8') as file:
+            file.write('shop: shop\ncategories:\n  - id: 1\n    name: category\ngoods:\n')
+            for number in range(1, 6):
+                file.write(f'  - {{id: {number}, category: 1, model: model, name: product {number}, price: 100,'
+                           f' price_rrc: 0, quantity: 1, parameters: {{}}}}\n')
+        self.addCleanup(os.unlink, self.path)
+        self.job = ImportJob.objects.create(mode='incremental')
+
+    def test_progress_during_import(self):
+        seen = []
+
+        def read_job():
+            seen.append(ImportJob.objects.values_list('state', 'rows_parsed', 'rows_written').get(id=self.job.id))
+            connection.close()
+
+        def watched_import(data, progress=None, **kwargs):
+            def watch(stats):
+                progress(stats)
+                # другой поток читает задачу своим соединением, как опрос partner/update/<job_id>
+                thread = threading.Thread(target=read_job)
+                thread.start()
+                thread.join()
+            return import_price_list(data, progress=watch, **kwargs)
+
+        with override_settings(PATH_TO_FILE=self.path, IMPORT_BATCH_SIZE=2), \
+                mock.patch('backend.tasks.import_price_list', watched_import):
+            do_import_task.apply(kwargs={'mode': 'incremental', 'job_id': self.job.id}).get()
+        self.assertEqual(seen, [('running', 2, 2), ('running', 4, 4), ('running', 5, 5)])
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.state, self.job.rows_parsed, self.job.rows_written), ('success', 5, 5))
@@ -4,33 +4,56 @@ from django.conf import settings
 from rest_framework.views import APIView
 from rest_framework.authtoken.models import Token
 from rest_framework.response import Response
-from django.db.models import Q, Sum, F
+from django.contrib.postgres.search import SearchRank
+from django.db.models import F
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
-from django.http import JsonResponse
-from .models import Shop, Category, ProductInfo, Order, OrderItem, Contact, ConfirmEmailToken
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django.http import JsonResponse, StreamingHttpResponse
+from .basket import OrderPlacementError, add_items, delete_items, get_summary, place_order, update_items
+from .cache import bump_catalog_version, cache_catalog_response
+from .catalog import CatalogFilterError, categories_with_counts, filter_products, product_facets
+from .exporters import EXPORT_FORMATS, export_catalog
+from .feeds import FeedURLError, feed_url
+from .importer import IMPORTERS
+from .models import Shop, OrderItem, Contact, ConfirmEmailToken, ImportJob, \
+    CatalogEntry
+from .search import build_search_query, search_enabled
+from .order_queries import OrderFilterError, filter_orders, partner_orders, user_orders
+from .pagination import OrderCursorPagination, OrderHistoryCursorPagination, ProductCursorPagination, \
+    ProductLimitOffsetPagination
 from .throttles import ShopImportRateThrottle
 
 from .serializers import CategorySerializer, ShopSerializer, OrderSerializer, \
-    ProductInfoSerializer, OrderItemSerializer, ContactSerializer, UserSerializer
-from .tasks import send_email_new_user_registered_task, send_email_new_order_task, do_import_task
+    CatalogEntrySerializer, OrderItemCreateSerializer, ContactSerializer, UserSerializer, ImportJobSerializer, \
+    OrderSummarySerializer, PartnerOrderSerializer
+from .tasks import send_email_new_user_registered_task, send_email_new_order_task, do_import_task, do_export_task
 
 
 class CategoryView(ListAPIView):
     """
     Класс для просмотра категорий
     """
-    queryset = Category.objects.all()
+    queryset = categories_with_counts()
     serializer_class = CategorySerializer
 
+    @cache_catalog_response
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
 
 class ShopView(ListAPIView):
     """
     Класс для просмотра списка магазинов
     """
-    queryset = Shop.objects.filter(state=True)
+    queryset = Shop.objects.filter(state=True).order_by('id')
     serializer_class = ShopSerializer
 
+    @cache_catalog_response
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
 
 class RegisterAccount(APIView):
     """
@@ -89,42 +112,142 @@ class PartnerUpdate(APIView):
         if request.user.type != "shop":
             return JsonResponse({"Status": False, "Error": "Only for Shop"})
 
-        if settings.PATH_TO_FILE:
-            res = do_import_task.delay()
-            if res.get():
-                return JsonResponse({"Status": True})
+        mode = request.data.get('mode')
+        if mode and mode not in IMPORTERS:
+            return JsonResponse({"Status": False, "Error": f"Unknown import mode: {mode}"})
+
+        shop = Shop.objects.filter(user_id=request.user.id).first()
+        url = request.data.get('url')
+        if url:
+            if not shop:
+                return JsonResponse({"Status": False, "Error": "Shop not found"})
+            try:
+                URLValidator(schemes=['http', 'https'])(url)
+                feed_url(url)
+            except (ValidationError, FeedURLError) as error:
+                return JsonResponse({"Status": False, "Error": str(error)})
+            if url != shop.url:
+                shop.url = url
+                shop.feed_etag = shop.feed_last_modified = shop.feed_hash = ''
+                shop.save(update_fields=['url', 'feed_etag', 'feed_last_modified', 'feed_hash'])
+
+        # без ссылки импортируется PATH_TO_FILE в магазин из файла, а не в магазин пользователя
+        if not (shop and shop.url):
+            shop = None
+        if shop or settings.PATH_TO_FILE:
+            # импорт выполняется в фоне, ход выполнения доступен по partner/update/<job_id>
+            job = ImportJob.objects.create(user=request.user, shop=shop, mode=mode or settings.IMPORT_MODE)
+            do_import_task.delay(shop_id=shop.id if shop else None, mode=mode, job_id=job.id)
+            return JsonResponse({"Status": True, "job_id": job.id}, status=202)
 
         return JsonResponse({"Status": False})
 
 
+class PartnerImportJobView(APIView):
+    """
+    Класс для получения статуса задачи импорта
+    """
+    def get(self, request, job_id, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
+
+        if request.user.type != 'shop':
+            return JsonResponse({'Status': False, 'Error': 'Only for shops'}, status=403)
+
+        job = ImportJob.objects.filter(id=job_id, user_id=request.user.id).first()
+        if not job:
+            return JsonResponse({'Status': False, 'Error': 'Import job not found'}, status=404)
+
+        # счетчики строк обновляются после каждой записанной пачки импорта
+        return Response(ImportJobSerializer(job).data)
+
+
+class PartnerExport(APIView):
+    """
+    Класс выгрузки каталога поставщика
+    """
+    # потоковая выгрузка, export_format - yaml, csv или jsonl
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
+
+        if request.user.type != 'shop':
+            return JsonResponse({'Status': False, 'Error': 'Only for shops'}, status=403)
+
+        shop = Shop.objects.filter(user_id=request.user.id).first()
+        if not shop:
+            return JsonResponse({'Status': False, 'Error': 'Shop not found'}, status=404)
+
+        export_format = request.query_params.get('export_format', 'yaml')
+        if export_format not in EXPORT_FORMATS:
+            return JsonResponse({'Status': False, 'Error': f'Unknown export format: {export_format}'})
+
+        response = StreamingHttpResponse(export_catalog(shop, export_format),
+                                         content_type=f'{EXPORT_FORMATS[export_format]}; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="shop_{shop.id}.{export_format}"'
+        return response
+
+    # выгрузка в файл фоновой задачей
+    def post(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
+
+        if request.user.type != 'shop':
+            return JsonResponse({'Status': False, 'Error': 'Only for shops'}, status=403)
+
+        shop = Shop.objects.filter(user_id=request.user.id).first()
+        if not shop:
+            return JsonResponse({'Status': False, 'Error': 'Shop not found'}, status=404)
+
+        export_format = request.data.get('export_format', 'yaml')
+        if export_format not in EXPORT_FORMATS:
+            return JsonResponse({'Status': False, 'Error': f'Unknown export format: {export_format}'})
+
+        result = do_export_task.delay(shop.id, export_format)
+        return JsonResponse({'Status': True, 'task_id': result.id}, status=202)
+
+
 class ProductInfoView(APIView):
     """
     Класс поиска товаров
     """
+    # по умолчанию страницы по курсору, с параметром offset - по limit/offset.
+    # фильтры: shop_id, category_id, price_min/price_max, price_rrc_min/price_rrc_max, parameter=<имя>:<значение>
+    @cache_catalog_response
     def get(self, request, *args, **kwargs):
-        query = Q(shop__state=True)
-        # shop_id = request.GET.get('shop_id')
-        # category_id = request.query_params.get('category_id')
-        #
-        # if shop_id:
-        #     query = query & Q(shop_id=shop_id)
-        #
-        # if category_id:
-        #     query = query & Q(product__category_id=category_id)
-        #
-        # queryset = ProductInfo.objects.filter(
-        #     query).select_related(
-        #     'shop', 'product__category').prefetch_related(
-        #     'product_parameters__parameter').distinct()
-        # serializer = ProductInfoSerializer(queryset, many=True)
+        try:
+            queryset = filter_products(CatalogEntry.objects.filter(shop_state=True), request.query_params)
+        except CatalogFilterError as error:
+            return JsonResponse({'Status': False, 'Error': str(error)}, status=400)
+
         product_name = request.query_params.get('product_name')
-        if product_name:
-            query = query & Q(product__name__icontains=product_name)
-        queryset = ProductInfo.objects.filter(query).select_related(
-            "shop", "product").prefetch_related(
-            'product_parameters__parameter')
-        serializer = ProductInfoSerializer(queryset, many=True)
-        return Response(serializer.data)
+        search_query = None
+        if product_name and search_enabled():
+            search_query = build_search_query(product_name)
+            queryset = queryset.filter(search_vector=search_query) if search_query else queryset.none()
+        elif product_name:
+            queryset = queryset.filter(product_name__icontains=product_name)
+
+        # фасеты одинаковы для всех страниц выборки, поэтому считаются только для первой
+        facets = None
+        if not request.query_params.get('cursor') and request.query_params.get('offset') in (None, '', '0'):
+            facets = product_facets(queryset)
+
+        # витрина уже содержит названия магазина, категории и параметры, поэтому связанные таблицы не читаются
+        queryset = queryset.order_by('pk')
+        if search_query is not None:
+            # найденные товары упорядочены по релевантности, поэтому страницы только по limit/offset
+            queryset = queryset.annotate(rank=SearchRank(F('search_vector'), search_query)).order_by('-rank', 'pk')
+        if search_query is not None or 'offset' in request.query_params:
+            paginator = ProductLimitOffsetPagination()
+        else:
+            paginator = ProductCursorPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = CatalogEntrySerializer(page, many=True)
+        response = paginator.get_paginated_response(serializer.data)
+        if facets is not None:
+            response.data['facets'] = facets
+        return response
 
 
 class PartnerState(APIView):
@@ -153,7 +276,10 @@ class PartnerState(APIView):
         state = request.data.get('state')
         if state:
             try:
-                Shop.objects.filter(user_id=request.user.id).update(state=strtobool(state))
+                state_value = strtobool(state)
+                Shop.objects.filter(user_id=request.user.id).update(state=state_value)
+                CatalogEntry.objects.filter(shop__user_id=request.user.id).update(shop_state=state_value)
+                bump_catalog_version()
                 return JsonResponse({"Status": True, "state": state})
             except ValueError as error:
                 return JsonResponse({"Status": False, "Error": f'{str(error)}'})
@@ -264,48 +390,34 @@ class BasketView(APIView):
     """
     Класс для работы с корзиной пользователя
     """
-    # добавление товаров в корзину
+    # добавление товаров в корзину: items - [{"product_info": ИД, "quantity": количество}, ...]
     def post(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
 
-        items_string = request.data.get('items')
-
-        if items_string:
-            basket, _ = Order.objects.get_or_create(user_id=request.user.id, status='basket')
-            objects_created = 0
-            for item in items_string:
-                item.update({'order': basket.id})
-                serializer = OrderItemSerializer(data=item)
-
-                if serializer.is_valid():
-                    try:
-                        serializer.save()
-                    except Exception as error:
-                        return JsonResponse({'Status': False, 'Errors': str(error)})
-                    else:
-                        objects_created += 1
-                else:
-                    JsonResponse({'Status': False, 'Errors': serializer.errors})
+        items = request.data.get('items')
 
-            return JsonResponse({'Status': True, 'Objects created': objects_created})
+        if items:
+            objects_created, objects_updated, errors = add_items(request.user.id, items)
+            return JsonResponse({'Status': bool(objects_created or objects_updated), 'Objects created': objects_created,
+                                 'Objects updated': objects_updated, 'Errors': errors})
 
         return JsonResponse({"Status": False})
 
-    # Получтить корзину
+    # Получтить корзину: итоги, с параметром detail=1 - и позиции
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
 
-        basket = Order.objects.filter(
-            user_id=request.user.id, status='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
-        serializer = OrderSerializer(basket, many=True)
-        return Response(serializer.data)
+        data = get_summary(request.user.id)
+        if request.query_params.get('detail') in ('1', 'true') and data['id']:
+            ordered_items = OrderItem.objects.filter(order_id=data['id']).select_related(
+                'product_info__product__category', 'product_info__shop').prefetch_related(
+                'product_info__product_parameters__parameter').order_by('id')
+            data = dict(data, ordered_items=OrderItemCreateSerializer(ordered_items, many=True).data)
+        return Response(data)
 
-    # редактировать количнество товаров
+    # редактировать количнество товаров: items - [{"id": ИД позиции, "quantity": количество}, ...]
     def put(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
@@ -313,17 +425,13 @@ class BasketView(APIView):
         items = request.data.get('items')
 
         if items:
-            basket, _ = Order.objects.get_or_create(user_id=request.user.id, status='basket')
-            objects_updated = 0
-            for item in items:
-                if type(item['id']) == int and type(item['quantity']) == int:
-                    objects_updated += OrderItem.objects.filter(order_id=basket.id, product_info_id=item['id']).update(
-                        quantity=item['quantity'])
-            return JsonResponse({"Status": True, "Updates_objects_count": objects_updated})
+            objects_updated, errors = update_items(request.user.id, items)
+            return JsonResponse({"Status": bool(objects_updated), "Updates_objects_count": objects_updated,
+                                 "Errors": errors})
 
         return JsonResponse({"Status": False})
 
-    # удалить товары из корзины
+    # удалить товары из корзины: items - [ИД позиции, ...]
     def delete(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
@@ -331,14 +439,8 @@ class BasketView(APIView):
         items = request.data.get('items')
 
         if items:
-            basket, _ = Order.objects.get_or_create(user_id=request.user.id, status='basket')
-            if basket:
-                objects_deleted = 0
-                for item_id in items:
-                    if type(item_id) == int:
-                        objects_deleted += OrderItem.objects.filter(order_id=basket.id,
-                                                                    product_info_id=item_id).delete()[0]
-                return JsonResponse({"Status": True, "Objects_deleted": objects_deleted})
+            objects_deleted, errors = delete_items(request.user.id, items)
+            return JsonResponse({"Status": True, "Objects_deleted": objects_deleted, "Errors": errors})
 
         return JsonResponse({"Status": False})
 
@@ -354,30 +456,40 @@ class PartnerOrders(APIView):
         if request.user.type != 'shop':
             return JsonResponse({'Status': False, 'Error': 'Только для магазинов'}, status=403)
 
-        order = Order.objects.filter(user_id=request.user.id).exclude(status='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').select_related('contact').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
-        serializer = OrderSerializer(order, many=True)
+        shop = Shop.objects.filter(user_id=request.user.id).first()
+        if not shop:
+            return JsonResponse({'Status': False, 'Error': 'Shop not found'}, status=404)
 
-        return Response(serializer.data)
+        # фильтры: status=<статус>[,<статус>], dt_from, dt_to; страницы по курсору
+        try:
+            queryset = filter_orders(partner_orders(shop.id), request.query_params)
+        except OrderFilterError as error:
+            return JsonResponse({'Status': False, 'Error': str(error)}, status=400)
+        paginator = OrderCursorPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = PartnerOrderSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
 
 class OrderView(APIView):
     """
     Класс для получения и размешения заказов пользователями
     """
-    # получение заказа пользователя
+    # история заказов пользователя: фильтры status, dt_from, dt_to, страницы по курсору,
+    # с параметром summary=1 - без позиций
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
 
-        order = Order.objects.filter(user_id=request.user.id).exclude(status='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').select_related('contact').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
-        serializer = OrderSerializer(order, many=True)
-        return Response(serializer.data)
+        summary = request.query_params.get('summary') in ('1', 'true')
+        try:
+            queryset = filter_orders(user_orders(request.user.id, summary), request.query_params)
+        except OrderFilterError as error:
+            return JsonResponse({'Status': False, 'Error': str(error)}, status=400)
+        paginator = OrderHistoryCursorPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = (OrderSummarySerializer if summary else OrderSerializer)(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
     # разместить заказ из корзины
     def post(self, request, *args, **kwargs):
@@ -385,18 +497,16 @@ class OrderView(APIView):
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
 
         if {'id', 'contact'}.issubset(request.data):
-            if type(request.data['id']) == int:
+            if type(request.data['id']) == int and str(request.data['contact']).isdigit():
+                # partial - разместить заказ с доступным остатком, иначе нехватка отклоняет заказ
+                partial = str(request.data.get('partial', '')).lower() in ('1', 'true')
                 try:
-                    is_updated = Order.objects.filter(
-                        user_id=request.user.id, id=request.data['id']).update(
-                        contact_id=request.data['contact'],
-                        status='new')
-                except Exception as error:
-                    return JsonResponse({'Status': False, 'Errors': str(error)})
-                else:
-                    if is_updated:
-                        send_email_new_order_task.delay(user_id=request.user.id)
-                        return JsonResponse({'Status': True})
+                    shortages = place_order(request.user.id, request.data['id'], int(request.data['contact']), partial)
+                except OrderPlacementError as error:
+                    return JsonResponse({'Status': False, 'Errors': str(error), 'Shortages': error.shortages},
+                                        status=409 if error.shortages else 400)
+                send_email_new_order_task.delay(user_id=request.user.id)
+                return JsonResponse({'Status': True, 'Shortages': shortages})
 
         return JsonResponse({'Status': False, 'Errors': 'All necessary arguments are not specified'})
 
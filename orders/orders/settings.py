@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/4.0/ref/settings/
 from pathlib import Path
 import os
 import environ
+from django.core.exceptions import ImproperlyConfigured
 
 env = environ.Env(
     DEBUG=(bool, True)
@@ -44,6 +45,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'backend.apps.BackendConfig',
@@ -137,6 +139,66 @@ AUTH_USER_MODEL = 'backend.User'
 
 PATH_TO_FILE = env('PATH_TO_FILE')
 
+# размер пачки товаров при импорте прайса
+IMPORT_BATCH_SIZE = env.int('IMPORT_BATCH_SIZE', default=1000)
+# режим импорта: 'incremental' - только изменения, 'full' - полная перезапись
+IMPORT_MODE = env('IMPORT_MODE', default='incremental')
+# запись при импорте: 'orm' - bulk_create/bulk_update, 'copy' - PostgreSQL COPY во временные таблицы
+IMPORT_BACKEND = env('IMPORT_BACKEND', default='orm')
+# таймаут загрузки прайса по Shop.url, секунды
+FEED_TIMEOUT = env.int('FEED_TIMEOUT', default=60)
+# разрешить Shop.url без схемы или file:// - путь к файлу на сервере, только для замеров и отладки
+FEED_ALLOW_LOCAL_FILES = env.bool('FEED_ALLOW_LOCAL_FILES', default=False)
+# размер пачки позиций при выгрузке каталога
+EXPORT_CHUNK_SIZE = env.int('EXPORT_CHUNK_SIZE', default=2000)
+# каталог для выгрузок, сделанных фоновой задачей
+EXPORT_DIR = env('EXPORT_DIR', default=os.path.join(BASE_DIR, 'exports'))
+# размер страницы списка товаров по умолчанию и максимальный
+PRODUCTS_PAGE_SIZE = env.int('PRODUCTS_PAGE_SIZE', default=50)
+PRODUCTS_MAX_PAGE_SIZE = env.int('PRODUCTS_MAX_PAGE_SIZE', default=500)
+# размер страницы списков заказов по умолчанию и максимальный
+ORDERS_PAGE_SIZE = env.int('ORDERS_PAGE_SIZE', default=50)
+ORDERS_MAX_PAGE_SIZE = env.int('ORDERS_MAX_PAGE_SIZE', default=500)
+# число значений параметров в фасетах списка товаров
+PRODUCTS_FACET_LIMIT = env.int('PRODUCTS_FACET_LIMIT', default=100)
+# конфигурация полнотекстового поиска PostgreSQL
+SEARCH_CONFIG = env('SEARCH_CONFIG', default='russian')
+# число одновременных импортов при обновлении прайсов всех магазинов
+IMPORT_CONCURRENCY = env.int('IMPORT_CONCURRENCY', default=4)
+# максимальная длительность блокировки импорта магазина, секунды
+IMPORT_LOCK_TTL = env.int('IMPORT_LOCK_TTL', default=3600)
+
+# кэш ответов каталога (категории, магазины, товары), версии каталога и корзин: 'file', 'redis' или 'locmem'.
+# Версия каталога меняется в воркере Celery после импорта и должна быть видна всем процессам, поэтому нужен
+# общий кэш: file - для процессов одного сервера, redis - для нескольких серверов. locmem виден только своему
+# процессу и допускается только при DEBUG
+CATALOG_CACHE_BACKEND = env('CATALOG_CACHE_BACKEND', default='file')
+# каталог для 'file', адрес сервера для 'redis'
+CATALOG_CACHE_LOCATION = env('CATALOG_CACHE_LOCATION', default='')
+# время жизни закэшированного ответа, секунды. Устаревшие ответы отсекаются версией каталога
+CATALOG_CACHE_TIMEOUT = env.int('CATALOG_CACHE_TIMEOUT', default=600)
+
+CATALOG_CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'catalog'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', os.path.join(BASE_DIR, 'cache')),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://localhost:6379/1'),
+}
+
+if CATALOG_CACHE_BACKEND == 'locmem' and not DEBUG:
+    raise ImproperlyConfigured("CATALOG_CACHE_BACKEND='locmem' is not shared between processes, use 'file' or 'redis'")
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': CATALOG_CACHE_BACKENDS[CATALOG_CACHE_BACKEND][0],
+        'LOCATION': CATALOG_CACHE_LOCATION or CATALOG_CACHE_BACKENDS[CATALOG_CACHE_BACKEND][1],
+        'TIMEOUT': CATALOG_CACHE_TIMEOUT,
+        'KEY_PREFIX': 'catalog',
+    },
+}
+
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 
 EMAIL_HOST = env('EMAIL_HOST')
@@ -18,7 +18,8 @@ from django.urls import path
 from django_rest_passwordreset.views import reset_password_request_token, reset_password_confirm
 
 from backend.views import CategoryView, ShopView, RegisterAccount, LoginAccount, PartnerUpdate, ProductInfoView, \
-    PartnerState, ContactView, AccountDetails, BasketView, PartnerOrders, OrderView, ConfirmAccount
+    PartnerState, ContactView, AccountDetails, BasketView, PartnerOrders, OrderView, ConfirmAccount, \
+    PartnerImportJobView, PartnerExport
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -30,6 +31,8 @@ urlpatterns = [
     path('user/password_reset', reset_password_request_token, name='password-reset'),
     path('user/password_reset/confirm', reset_password_confirm, name='password-reset-confirm'),
     path('partner/update', PartnerUpdate.as_view(), name='partner-update'),
+    path('partner/update/<int:job_id>', PartnerImportJobView.as_view(), name='partner-update-job'),
+    path('partner/export', PartnerExport.as_view(), name='partner-export'),
     path('partner/state', PartnerState.as_view(), name='partner-state'),
     path('partner/orders', PartnerOrders.as_view(), name='partner-orders'),
     path('products', ProductInfoView.as_view(), name='products'),